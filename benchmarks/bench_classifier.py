@@ -0,0 +1,89 @@
+"""Per-activity cost of the activity classifier.
+
+Usage:
+    python benchmarks/bench_classifier.py [--activities N] [--repeat N]
+
+Times the original four-re.search classify() against ActivityClassifier with
+the built-in rule table and with an extended table (lab/assignment/quiz), on
+synthetic activity titles with short and long descriptions. The built-in
+table must agree with the original on every activity.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["LOG_FILE"] = ""
+import main  # noqa: E402
+from moodle_pages import TITLE_WORDS  # noqa: E402
+
+EXTENDED_RULES = main.DEFAULT_CLASSIFIER_RULES + [
+    {"category": "lab", "pattern": r"\blab(oratory)?s?\b"},
+    {"category": "assignment", "pattern": r"\b(assignment|coursework)s?\b"},
+    {"category": "quiz", "pattern": r"\bquiz(zes)?\b"},
+]
+
+LONG_DESC = ("This week's reading covers the material discussed in class; please review the slides "
+             "and attempt the exercises before the session.")
+
+
+def legacy_classify(title, desc):
+    """classify() as it was before the rule table."""
+    text = f"{title} {desc}".lower()
+    if re.search(r'\bpost[- ]?lecture\b', text):
+        return "post_lecture"
+    elif re.search(r'\bpre[- ]?lecture\b', text):
+        return "pre_lecture"
+    elif re.search(r'\blecture\b', text):
+        return "lecture"
+    elif re.search(r'\btutorial\b', text):
+        return "tutorial"
+    return "others"
+
+
+def make_activities(count, descriptions, seed=1):
+    rng = random.Random(seed)
+    return [(f"{rng.choice(TITLE_WORDS)} {i} - {rng.choice(TITLE_WORDS)}", rng.choice(descriptions))
+            for i in range(count)]
+
+
+def per_activity(func, activities, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for title, desc in activities:
+            func(title, desc)
+    return (time.perf_counter() - started) / repeat / len(activities)
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--activities", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    default = main.ActivityClassifier(main.DEFAULT_CLASSIFIER_RULES)
+    extended = main.ActivityClassifier(EXTENDED_RULES)
+    variants = [("original", legacy_classify), ("rule table", default.classify),
+                ("extended table", extended.classify)]
+    sets = [
+        ("short desc", make_activities(args.activities, ["", "", "", "Notes for week 3"])),
+        ("long desc", make_activities(args.activities, [LONG_DESC])),
+    ]
+
+    print(f"{'activities':<14}" + "".join(f"{name:>18}" for name, _ in variants))
+    for label, activities in sets:
+        mismatches = sum(legacy_classify(t, d) != default.classify(t, d) for t, d in activities)
+        if mismatches:
+            sys.exit(f"{label}: built-in rule table disagrees with the original on {mismatches} activities")
+        row = f"{label:<14}"
+        for _, func in variants:
+            row += f"{per_activity(func, activities, args.repeat) * 1e9:>16.0f}ns"
+        print(row)
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,70 @@
+"""Measure how the process-pool parsing stage (PARSE_WORKERS) scales.
+
+Usage:
+    python benchmarks/bench_parse_pool.py [--pages N] [--workers 1,2,4,8]
+
+Renders N synthetic course pages of mixed sizes and runs parse_page_bytes
+over all of them, first in-process and then on spawn process pools of each
+worker count (after a warm-up so worker start-up is not timed). Also shows
+how many bytes cross the process boundary in each direction.
+"""
+import argparse
+import multiprocessing
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["LOG_FILE"] = ""
+import main  # noqa: E402
+from moodle_pages import render_course_page  # noqa: E402
+
+
+def make_pages(count):
+    sizes = [(4, 4), (15, 10), (30, 25)]
+    pages = []
+    for i in range(count):
+        n_sections, n_activities = sizes[i % len(sizes)]
+        pages.append(render_course_page(i, n_sections=n_sections, n_activities=n_activities).encode("utf-8"))
+    return pages
+
+
+def run_pool(pages, workers):
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Warm up every worker (imports main) before timing
+        list(pool.map(main.parse_page_bytes, pages[:workers]))
+        started = time.perf_counter()
+        results = list(pool.map(main.parse_page_bytes, pages, chunksize=1))
+        return time.perf_counter() - started, results
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--workers", default="1,2,4,8")
+    args = parser.parse_args()
+
+    pages = make_pages(args.pages)
+    started = time.perf_counter()
+    expected = [main.parse_page_bytes(body) for body in pages]
+    inline = time.perf_counter() - started
+
+    sent = sum(len(pickle.dumps(body)) for body in pages)
+    returned = sum(len(pickle.dumps(result)) for result in expected)
+    print(f"{args.pages} pages, {sent // 1024}KB sent to workers, {returned // 1024}KB returned "
+          f"({returned / sent:.0%} of the input), {os.cpu_count()} CPUs")
+    print(f"{'workers':<12}{'total':>12}{'pages/s':>12}{'speedup':>10}")
+    print(f"{'in-process':<12}{inline * 1000:>10.0f}ms{args.pages / inline:>12.1f}{1:>9.2f}x")
+    for workers in (int(w) for w in args.workers.split(",")):
+        elapsed, results = run_pool(pages, workers)
+        if results != expected:
+            print(f"{workers:<12}{'MISMATCH':>12}")
+            continue
+        print(f"{workers:<12}{elapsed * 1000:>10.0f}ms{args.pages / elapsed:>12.1f}{inline / elapsed:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main_()
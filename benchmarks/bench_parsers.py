@@ -0,0 +1,76 @@
+"""Compare PARSER_BACKENDS on saved or synthetic course pages.
+
+Usage:
+    python benchmarks/bench_parsers.py [--pages DIR] [--repeat N]
+
+Saved pages (``*.html`` from "Save page as" on a course page) are read from
+--pages; without it a small/medium/large synthetic set is generated. Every
+backend's course_data is checked against html.parser before it is timed.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["LOG_FILE"] = ""
+import main  # noqa: E402
+from moodle_pages import render_course_page  # noqa: E402
+
+
+def load_pages(pages_dir):
+    if pages_dir:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(pages_dir, "*.html"))):
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                pages.append((os.path.basename(path), f.read()))
+        return pages
+    return [
+        ("synthetic-small", render_course_page(1, n_sections=4, n_activities=4)),
+        ("synthetic-medium", render_course_page(2, n_sections=15, n_activities=10)),
+        ("synthetic-large", render_course_page(3, n_sections=30, n_activities=25)),
+        ("synthetic-labels", render_course_page(4, n_sections=15, n_activities=10, big_labels=True)),
+    ]
+
+
+def available_backends():
+    return [name for name in main.PARSER_BACKENDS if main.resolve_parser_backend(name) == name]
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", help="directory of saved course pages (*.html)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages)
+    if not pages:
+        sys.exit(f"No *.html pages found in {args.pages}")
+    backends = available_backends()
+
+    print(f"{'page':<24}{'size':>10}" + "".join(f"{b:>16}" for b in backends))
+    totals = dict.fromkeys(backends, 0.0)
+    for name, html in pages:
+        expected = main.parse_course_page(html, "html.parser")
+        row = f"{name[:23]:<24}{len(html) // 1024:>8}KB"
+        for backend in backends:
+            if main.parse_course_page(html, backend) != expected:
+                row += f"{'MISMATCH':>16}"
+                continue
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                main.parse_course_page(html, backend)
+            elapsed = (time.perf_counter() - started) / args.repeat
+            totals[backend] += elapsed
+            row += f"{elapsed * 1000:>14.1f}ms"
+        print(row)
+
+    print(f"{'total':<34}" + "".join(f"{totals[b] * 1000:>14.1f}ms" for b in backends))
+    base = totals["html.parser"]
+    print(f"{'speedup':<34}" + "".join(f"{base / totals[b] if totals[b] else 0:>15.2f}x" for b in backends))
+
+
+if __name__ == "__main__":
+    main_()
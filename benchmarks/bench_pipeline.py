@@ -0,0 +1,258 @@
+"""Offline benchmark of the parse -> classify -> hash -> diff pipeline, checked against a baseline.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--pages DIR] [--repeat N] [--rounds 5] [--tolerance 0.5]
+                                        [--baseline FILE] [--update-baseline]
+
+Every case is a course page as raw bytes, as the fetch stage hands it over:
+saved pages (``*.html``) from --pages, or a synthetic corpus from small to
+very large. Synthetic cases also get "N items changed" variants of the large
+page, which are diffed against it the way process_course() does. For each case
+the best time over at least --repeat runs and the tracemalloc peak of every stage is reported:
+
+    parse     decode + parse_course_page (includes parse_activities/classify)
+    classify  ActivityClassifier.classify over every activity title on the page
+    hash      hash_tree
+    diff      changed_scope + diff_course_data (variants only)
+
+Results are compared with the baseline file (default
+benchmarks/pipeline_baseline.json). Times are divided by a fixed
+pure-Python calibration loop timed on the same run, so a baseline recorded
+on one machine stays roughly usable on another. A stage that is slower, or
+whose peak memory is larger, than the baseline by more than --tolerance is
+re-measured over --rounds rounds, each with its own calibration, and the
+median is kept; if that is still out of tolerance it is reported as a
+regression and the script exits with status 1. Differences of less than
+MIN_SECONDS_DELTA are ignored, as sub-millisecond stages vary more than that
+between runs. A stage whose backend (parser_backend for parse, hash_backend
+for hash) differs from the baseline's is not compared. Refresh the baseline
+with --update-baseline after an intended change.
+"""
+import argparse
+import gc
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["LOG_FILE"] = ""
+import main  # noqa: E402
+from moodle_pages import render_course_page  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline_baseline.json")
+STAGES = ("parse", "classify", "hash", "diff")
+# Differences below these are noise, whatever the ratio says
+MIN_SECONDS_DELTA = 0.002
+MIN_PEAK_DELTA_KB = 64
+
+
+def synthetic_cases():
+    """[(name, body, base name or None)]: sizes small -> very large, then changed variants."""
+    sizes = [
+        ("small", dict(n_sections=4, n_activities=4)),
+        ("medium", dict(n_sections=15, n_activities=10)),
+        ("large", dict(n_sections=30, n_activities=25)),
+        ("xlarge", dict(n_sections=60, n_activities=50)),
+        ("labels", dict(n_sections=15, n_activities=10, big_labels=True)),
+    ]
+    cases = [(name, render_course_page(3, **kwargs).encode("utf-8"), None) for name, kwargs in sizes]
+    for changed in (1, 10, 100):
+        body = render_course_page(3, n_sections=30, n_activities=25, changed_items=changed).encode("utf-8")
+        cases.append((f"large+{changed}changed", body, "large"))
+    return cases
+
+
+def recorded_cases(pages_dir):
+    cases = []
+    for path in sorted(glob.glob(os.path.join(pages_dir, "*.html"))):
+        with open(path, "rb") as f:
+            cases.append((os.path.basename(path), f.read(), None))
+    return cases
+
+
+def calibrate():
+    """Seconds for a fixed pure-Python workload (dict/str/loop heavy, like the pipeline)."""
+    best = float("inf")
+    for _ in range(5):
+        started = time.perf_counter()
+        index = {}
+        for i in range(200000):
+            key = f"item-{i % 5000}"
+            index[key] = index.get(key, 0) + len(key)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def measure(func, repeat, min_total=0.25):
+    """(best seconds, tracemalloc peak in KB of one extra run, result).
+
+    Runs func at least repeat times and, for cheap stages, until min_total
+    seconds have passed, so the best time is not one lucky or unlucky sample.
+    The garbage collector is off while timing, as in timeit: otherwise a
+    collection over the previous (large) case lands on whichever stage runs next.
+    """
+    best = float("inf")
+    runs = 0
+    spent = 0.0
+    gc.collect()
+    gc.disable()
+    try:
+        while runs < repeat or (spent < min_total and runs < 1000):
+            started = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - started
+            best = min(best, elapsed)
+            spent += elapsed
+            runs += 1
+    finally:
+        gc.enable()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak / 1024, result
+
+
+def activity_titles(data):
+    return [item["title"] for entries in data.values() for items in entries.values() for item in items
+            if "title" in item]
+
+
+def run_case(body, base, repeat):
+    results = {}
+    results["parse"] = measure(lambda: main.parse_course_page(body.decode("utf-8", errors="replace")), repeat)
+    _, data = results["parse"][2]
+    classifier = main.classifier_rules.get()
+    titles = activity_titles(data)
+    results["classify"] = measure(lambda: [classifier.classify(title, "") for title in titles], repeat)
+    results["hash"] = measure(lambda: main.hash_tree(data), repeat)
+    if base is not None:
+        base_data, base_tree = base
+        _, tree = results["hash"][2]
+
+        def diff():
+            return main.diff_course_data(base_data, data, main.changed_scope(base_tree, tree))
+
+        results["diff"] = measure(diff, repeat)
+    return {stage: {"seconds": seconds, "peak_kb": peak} for stage, (seconds, peak, _) in results.items()}, data
+
+
+def hash_backend():
+    return "xxhash" if main.xxhash is not None else "blake2b"
+
+
+# Stages whose time depends on an optional backend; they are only compared with a baseline that used the same one
+BACKEND_STAGES = {"parser_backend": "parse", "hash_backend": "hash"}
+
+
+def remeasure(body, base, repeat, rounds, calibration):
+    """Median of rounds fresh run_case() results, each scaled to calibration by its own calibrate() run."""
+    results = []
+    for _ in range(rounds):
+        scale = calibration / calibrate()
+        stages, _ = run_case(body, base, repeat)
+        results.append({stage: (r["seconds"] * scale, r["peak_kb"]) for stage, r in stages.items()})
+    return {
+        stage: {"seconds": statistics.median(r[stage][0] for r in results),
+                "peak_kb": statistics.median(r[stage][1] for r in results)}
+        for stage in results[0]
+    }
+
+
+def compare(current, baseline, tolerance, skip_stages=()):
+    """Return [(case, regression message)] (empty when everything is within tolerance)."""
+    problems = []
+    scale = current["calibration"] / baseline["calibration"]
+    for case, stages in current["cases"].items():
+        for stage, now in stages.items():
+            before = baseline["cases"].get(case, {}).get(stage)
+            if before is None or stage in skip_stages:
+                continue
+            expected = before["seconds"] * scale
+            if now["seconds"] > expected * (1 + tolerance) and now["seconds"] - expected > MIN_SECONDS_DELTA:
+                problems.append((case, f"{case} {stage}: {now['seconds'] * 1000:.2f}ms vs baseline "
+                                       f"{expected * 1000:.2f}ms (machine-adjusted), +{now['seconds'] / expected - 1:.0%}"))
+            if (now["peak_kb"] > before["peak_kb"] * (1 + tolerance)
+                    and now["peak_kb"] - before["peak_kb"] > MIN_PEAK_DELTA_KB):
+                problems.append((case, f"{case} {stage}: peak {now['peak_kb']:.0f}KB vs baseline "
+                                       f"{before['peak_kb']:.0f}KB, +{now['peak_kb'] / before['peak_kb'] - 1:.0%}"))
+    return problems
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", help="directory of recorded course pages (*.html) instead of the synthetic corpus")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=5, help="rounds to re-measure a suspected regression over")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown/growth before failing (0.5 = 50%%)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="write this run as the new baseline")
+    args = parser.parse_args()
+
+    cases = recorded_cases(args.pages) if args.pages else synthetic_cases()
+    if not cases:
+        sys.exit(f"No *.html pages found in {args.pages}")
+
+    current = {"calibration": calibrate(), "python": sys.version.split()[0], "parser_backend": main.PARSER_BACKEND,
+               "hash_backend": hash_backend(), "cases": {}}
+    parsed = {}
+    inputs = {}
+    print(f"{'case':<22}{'size':>9}" + "".join(f"{stage:>12}{'peak':>9}" for stage in STAGES))
+    for name, body, base_name in cases:
+        base = parsed.get(base_name)
+        inputs[name] = (body, base)
+        stages, data = run_case(body, base, args.repeat)
+        parsed[name] = (data, main.hash_tree(data)[1])
+        current["cases"][name] = stages
+        row = f"{name[:21]:<22}{len(body) // 1024:>7}KB"
+        for stage in STAGES:
+            if stage in stages:
+                row += f"{stages[stage]['seconds'] * 1000:>10.2f}ms{stages[stage]['peak_kb'] / 1024:>7.1f}MB"
+            else:
+                row += f"{'-':>12}{'-':>9}"
+        print(row)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one")
+        return
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    skip_stages = set()
+    for key in ("parser_backend", "hash_backend", "python"):
+        if baseline.get(key) != current[key]:
+            note = f"Note: baseline was recorded with {key}={baseline.get(key)}, this run has {current[key]}"
+            if key in BACKEND_STAGES:
+                skip_stages.add(BACKEND_STAGES[key])
+                note += f"; not comparing the {BACKEND_STAGES[key]} stage"
+            print(note)
+    problems = compare(current, baseline, args.tolerance, skip_stages)
+    if problems:
+        # One slow sample is usually the machine, not the code: measure the
+        # suspicious cases over several rounds and judge them by the median
+        for name in sorted({case for case, _ in problems}):
+            body, base = inputs[name]
+            current["cases"][name] = remeasure(body, base, args.repeat, args.rounds, current["calibration"])
+        problems = compare(current, baseline, args.tolerance, skip_stages)
+    if problems:
+        print(f"\nREGRESSION against {args.baseline} (tolerance {args.tolerance:.0%}):")
+        for _, problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print(f"\nWithin {args.tolerance:.0%} of the baseline in {args.baseline}")
+
+
+if __name__ == "__main__":
+    main_()
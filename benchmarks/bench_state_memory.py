@@ -0,0 +1,73 @@
+"""Measure how much memory the loaded scraper state (previous_data) takes per course.
+
+Usage:
+    python benchmarks/bench_state_memory.py [--courses N] [--backend sqlite|json]
+
+Parses N synthetic courses of mixed sizes, records them through
+update_course_state()/save_state() as process_course() does, then reloads
+the state with open_state_store() the way the scraper starts up. It reports
+the memory previous_data holds afterwards (tracemalloc), its pickled size,
+and how long loading took. It runs in a temporary directory, so no real state
+is touched.
+"""
+import argparse
+import os
+import pickle
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["LOG_FILE"] = ""
+import main  # noqa: E402
+from moodle_pages import render_course_page  # noqa: E402
+
+SIZES = [(4, 4), (15, 10), (30, 25), (12, 8)]
+
+
+def record_courses(count):
+    for course_id in range(1, count + 1):
+        n_sections, n_activities = SIZES[course_id % len(SIZES)]
+        body = render_course_page(course_id, n_sections=n_sections, n_activities=n_activities).encode("utf-8")
+        (title, data, (data_hash, tree)), _ = main.parse_page_bytes_timed(body)
+        main.update_course_state(
+            str(course_id), title=title, hash=data_hash, tree=tree, data=data,
+            validators={"etag": None, "last_modified": None, "content_length": len(body), "digest": "0" * 32},
+            schedule={"interval": 120.0, "next_due": time.time() + 120},
+        )
+    main.save_state()
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--courses", type=int, default=200)
+    parser.add_argument("--backend", default="sqlite", choices=sorted(main.STATE_STORES))
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="lms-state-")
+    os.chdir(workdir)
+    main.open_state_store(args.backend)
+    record_courses(args.courses)
+    main.state_store.close()
+    main.previous_data.clear()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    main.open_state_store(args.backend)
+    load_seconds = time.perf_counter() - started
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    pickled = len(pickle.dumps(main.previous_data))
+    main.state_store.close()
+
+    print(f"{args.courses} courses, {args.backend} store in {workdir}")
+    print(f"previous_data: {held / args.courses / 1024:.1f}KB per course in memory "
+          f"({held / 1024 / 1024:.1f}MB total), {pickled / args.courses / 1024:.1f}KB per course pickled")
+    print(f"load: {load_seconds * 1000:.0f}ms ({load_seconds / args.courses * 1e6:.0f}us per course)")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,66 @@
+"""Compare scraping course pages with reading core_course_get_contents JSON.
+
+Usage:
+    python benchmarks/bench_webservice.py [--repeat N]
+
+Renders synthetic courses both as a course page and as the web service
+response for the same content, checks that parse_course_page and
+parse_course_contents give the same course_data, and reports the bytes
+transferred and the parse + hash time of each course source.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["LOG_FILE"] = ""
+import main  # noqa: E402
+from moodle_pages import render_course_contents, render_course_page  # noqa: E402
+
+COURSES = [
+    ("small", dict(n_sections=4, n_activities=4)),
+    ("medium", dict(n_sections=15, n_activities=10)),
+    ("large", dict(n_sections=30, n_activities=25)),
+    ("labels", dict(n_sections=15, n_activities=10, big_labels=True)),
+]
+
+
+def best_time(func, body, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(body)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'course':<10}{'page':>10}{'json':>10}{'bytes':>8}{'page parse':>13}{'json parse':>13}{'speedup':>10}")
+    totals = [0, 0, 0.0, 0.0]
+    for name, kwargs in COURSES:
+        page = render_course_page(3, **kwargs).encode("utf-8")
+        contents = json.dumps(render_course_contents(3, **kwargs)).encode("utf-8")
+        (_, page_data, _), _ = main.parse_page_bytes_timed(page)
+        (_, json_data, _), _ = main.parse_contents_bytes_timed(contents)
+        if page_data != json_data:
+            print(f"{name:<10}MISMATCH between page and web service course_data")
+            continue
+        page_s = best_time(main.parse_page_bytes_timed, page, args.repeat)
+        json_s = best_time(main.parse_contents_bytes_timed, contents, args.repeat)
+        for i, value in enumerate((len(page), len(contents), page_s, json_s)):
+            totals[i] += value
+        print(f"{name:<10}{len(page) // 1024:>8}KB{len(contents) // 1024:>8}KB{len(contents) / len(page):>8.0%}"
+              f"{page_s * 1000:>11.1f}ms{json_s * 1000:>11.1f}ms{page_s / json_s:>9.1f}x")
+    print(f"{'total':<10}{totals[0] // 1024:>8}KB{totals[1] // 1024:>8}KB{totals[1] / totals[0]:>8.0%}"
+          f"{totals[2] * 1000:>11.1f}ms{totals[3] * 1000:>11.1f}ms{totals[2] / totals[3]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,238 @@
+"""Run the scraper against the local Moodle stand-in and report how it scales.
+
+Usage:
+    python benchmarks/load_sim.py [--courses 100,500,2000] [--duration 60] [--interval 10]
+                                  [--latency 0.05] [--error-rate 0.01] [--login-rate 0]
+                                  [--change-interval 60] [--web-service] [--change-feed S]
+                                  [--env KEY=VALUE ...]
+
+For every course count, benchmarks/moodle_sim.py and main.py are started as
+separate processes in a fresh temporary directory: course_urls.json lists
+https://lms.example.edu/course/view.php?id=1..N, cookies.json holds a dummy
+MoodleSession, LMS_BASE_URL points at the simulator and METRICS_PORT exposes
+/metrics. No Discord token is passed. Every course is polled on a fixed
+--interval (POLL_MIN/BASE/MAX_INTERVAL, no POLL_MAX_RPS limit), so the offered
+load is N / interval polls per second. After --duration seconds the scraper
+gets SIGTERM and the run is reported:
+
+    offered     N / interval, the polls per second the schedule asks for
+    polls/s     completed polls per second (lms_scraper_courses_total, after start-up)
+    errors      failed polls (503s left after retries, login redirects)
+    notify p50/p95/max
+                seconds from a simulated change to the scraper recording it
+                (change_history.detected_at, the moment the notification is queued)
+    undetected  simulated changes the scraper had not picked up when it stopped
+    cpu         scraper CPU time (user + system, including parse workers) as a
+                share of one core
+    peak RSS    the scraper's peak resident memory (Linux only, main process)
+
+--web-service reads courses through the simulator's web service
+(MOODLE_WS_TOKEN) instead of its pages. --change-feed S also sets
+CHANGE_FEED_INTERVAL=S, so --interval becomes the safety sweep and only the
+courses the feed reports are polled in between. Extra scraper settings
+(SCRAPE_CONCURRENCY, PARSE_WORKERS, PARSER_BACKEND, ...) go in --env. When polls/s falls below offered, the scraper is saturated.
+"""
+import argparse
+import json
+import os
+import resource
+import signal
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+MAIN_PY = os.path.join(os.path.dirname(BENCH_DIR), "main.py")
+SIM_PY = os.path.join(BENCH_DIR, "moodle_sim.py")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def http_get(url, timeout=5):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read().decode("utf-8")
+
+
+def wait_for(url, timeout, process):
+    """Poll url until it answers; returns its body."""
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"process exited with status {process.returncode} before {url} came up")
+        try:
+            return http_get(url)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def courses_polled(metrics_text):
+    """(total polls, failed polls) from the scraper's /metrics output."""
+    total = errors = 0
+    for line in metrics_text.splitlines():
+        if line.startswith("lms_scraper_courses_total{"):
+            value = float(line.rsplit(" ", 1)[1])
+            total += value
+            if 'outcome="error"' in line:
+                errors += value
+    return total, errors
+
+
+def peak_rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def notify_latencies(changes, db_path):
+    """(seconds from change to detection per detected change, number of undetected changes)."""
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT course_id, detected_at FROM change_history WHERE kind = 'added' GROUP BY course_id, detected_at"
+        ).fetchall()
+    finally:
+        conn.close()
+    detections = {}
+    for course_id, detected_at in rows:
+        detections.setdefault(int(course_id), []).append(datetime.fromisoformat(detected_at).timestamp())
+    latencies = []
+    undetected = 0
+    for course_id, _, changed_at in changes:
+        # A detection covers every change made since the previous poll of that course
+        later = [t for t in detections.get(course_id, ()) if t >= changed_at]
+        if later:
+            latencies.append(min(later) - changed_at)
+        else:
+            undetected += 1
+    return latencies, undetected
+
+
+def run_step(courses, args):
+    workdir = tempfile.mkdtemp(prefix=f"lms-load-{courses}-")
+    with open(os.path.join(workdir, "course_urls.json"), "w", encoding="utf-8") as f:
+        json.dump([f"https://lms.example.edu/course/view.php?id={i}" for i in range(1, courses + 1)], f)
+    with open(os.path.join(workdir, "cookies.json"), "w", encoding="utf-8") as f:
+        json.dump({"name": "MoodleSession", "value": "load-test", "domain": "lms.example.edu"}, f)
+
+    sim_port, metrics_port = free_port(), free_port()
+    sim = subprocess.Popen(
+        [sys.executable, SIM_PY, "--courses", str(courses), "--port", str(sim_port),
+         "--latency", str(args.latency), "--error-rate", str(args.error_rate),
+         "--login-rate", str(args.login_rate), "--change-interval", str(args.change_interval)],
+        stdout=subprocess.DEVNULL,
+    )
+    env = {
+        **os.environ,
+        "LMS_BASE_URL": f"http://127.0.0.1:{sim_port}",
+        "METRICS_PORT": str(metrics_port),
+        "POLL_BASE_INTERVAL": str(args.interval),
+        "POLL_MIN_INTERVAL": str(args.interval),
+        "POLL_MAX_INTERVAL": str(args.interval),
+        "POLL_MAX_RPS": "0",
+        "DISCORD_BOT_TOKEN": "",
+        "DISCORD_NOTIFY_CHANNEL_ID": "",
+        "DISCORD_LOG_CHANNEL_ID": "",
+    }
+    if args.web_service or args.change_feed:
+        env["MOODLE_WS_TOKEN"] = "sim-token"
+    if args.change_feed:
+        env["CHANGE_FEED_INTERVAL"] = str(args.change_feed)
+    env.update(item.split("=", 1) for item in args.env)
+    scraper = None
+    try:
+        wait_for(f"http://127.0.0.1:{sim_port}/sim/stats", 15, sim)
+        cpu_before = children_cpu()
+        with open(os.path.join(workdir, "scraper.out"), "wb") as out:
+            scraper = subprocess.Popen([sys.executable, MAIN_PY], cwd=workdir, env=env,
+                                       stdout=out, stderr=subprocess.STDOUT)
+        metrics_url = f"http://127.0.0.1:{metrics_port}/metrics"
+        # Rates are measured from the moment the scraper serves metrics, so imports and start-up are excluded
+        polled_before, _ = courses_polled(wait_for(metrics_url, 60, scraper))
+        started = time.monotonic()
+        time.sleep(args.duration)
+        polled, errors = courses_polled(http_get(metrics_url))
+        elapsed = time.monotonic() - started
+        rss = peak_rss_mb(scraper.pid)
+        scraper.send_signal(signal.SIGTERM)
+        scraper.wait(timeout=60)
+        cpu = children_cpu() - cpu_before
+        sim_stats = json.loads(http_get(f"http://127.0.0.1:{sim_port}/sim/stats"))
+    except Exception:
+        print(f"  scraper output is in {os.path.join(workdir, 'scraper.out')}")
+        raise
+    finally:
+        if scraper is not None and scraper.poll() is None:
+            scraper.kill()
+        sim.terminate()
+        sim.wait(timeout=10)
+
+    latencies, undetected = notify_latencies(sim_stats["changes"], os.path.join(workdir, "scraper_state.db"))
+    return {
+        "polls_per_s": (polled - polled_before) / elapsed,
+        "errors": int(errors),
+        "latencies": latencies,
+        "undetected": undetected,
+        "cpu_share": cpu / (elapsed + 0.0001),
+        "rss_mb": rss,
+        "sim": sim_stats,
+        "workdir": workdir,
+    }
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--courses", default="100,500,2000", help="comma-separated course counts to run")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to measure each course count")
+    parser.add_argument("--interval", type=float, default=10, help="poll interval per course, seconds")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--login-rate", type=float, default=0.0)
+    parser.add_argument("--change-interval", type=float, default=60, help="mean seconds between changes of one course")
+    parser.add_argument("--web-service", action="store_true", help="use the web service instead of course pages")
+    parser.add_argument("--change-feed", type=float, default=0, help="CHANGE_FEED_INTERVAL in seconds (implies --web-service)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra scraper setting")
+    args = parser.parse_args()
+
+    print(f"{'courses':>8}{'offered':>10}{'polls/s':>10}{'errors':>8}{'notify p50':>12}{'p95':>8}{'max':>8}"
+          f"{'undetected':>12}{'cpu':>7}{'peak RSS':>10}")
+    for courses in (int(c) for c in args.courses.split(",")):
+        result = run_step(courses, args)
+        latencies = sorted(result["latencies"])
+        if latencies:
+            p50 = statistics.median(latencies)
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            notify = f"{p50:>11.1f}s{p95:>7.1f}s{latencies[-1]:>7.1f}s"
+        else:
+            notify = f"{'-':>12}{'-':>8}{'-':>8}"
+        rss = f"{result['rss_mb']:>8.0f}MB" if result["rss_mb"] is not None else f"{'-':>10}"
+        print(f"{courses:>8}{courses / args.interval:>10.1f}{result['polls_per_s']:>10.1f}{result['errors']:>8}"
+              f"{notify}{result['undetected']:>12}{result['cpu_share']:>7.0%}{rss}")
+        sim = result["sim"]
+        print(f"{'':>8}  simulator: {sim['requests']} requests ({sim['ws_calls']} web service calls), {sim['errors']} 503s, "
+              f"{sim['login_redirects']} login redirects, {len(sim['changes'])} changes; files in {result['workdir']}")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,194 @@
+"""Synthetic Moodle course pages for benchmarks and local testing.
+
+The markup mirrors what parse_course_page() expects from a real Moodle 4.x
+course page: an ``h1`` page title, an optional ``ul.general-section-activities``
+list, and ``li.section.main`` sections holding ``li.activity`` items with
+``.instancename``/``a.aalink`` links, descriptions and label notices. Page
+chrome (navigation, drawers, footer) is included so parser costs are realistic.
+render_course_contents() returns the same course as Moodle's
+core_course_get_contents web service would.
+"""
+import html
+import random
+
+ACTIVITY_KINDS = ("resource", "url", "assign", "quiz", "forum", "page", "folder")
+TITLE_WORDS = (
+    "Lecture", "Pre-Lecture", "Post-Lecture", "Tutorial", "Lab", "Assignment", "Quiz",
+    "Slides", "Notes", "Reading", "Recording", "Worksheet", "Solutions", "Project",
+)
+
+PAGE_HEAD = """<!DOCTYPE html>
+<html dir="ltr" lang="en" xml:lang="en">
+<head><meta charset="utf-8"><title>Course: {title}</title>
+<link rel="stylesheet" href="https://lms.example.edu/theme/styles.php/boost/1/all">
+<script>M.cfg = {{"wwwroot":"https:\\/\\/lms.example.edu","sesskey":"{sesskey}"}};</script>
+</head>
+<body id="page-course-view-topics" class="format-topics path-course path-course-view">
+<nav class="navbar fixed-top"><ul class="navbar-nav">
+<li class="nav-item"><a class="nav-link" href="https://lms.example.edu/my/">Dashboard</a></li>
+<li class="nav-item"><a class="nav-link" href="https://lms.example.edu/my/courses.php">My courses</a></li>
+</ul></nav>
+<div id="page" class="container-fluid">
+<header id="page-header"><div class="page-context-header"><div class="page-header-headings">
+<h1 class="h2">{title}</h1></div></div></header>
+<div id="region-main"><div class="course-content">
+"""
+
+PAGE_TAIL = """</div></div></div>
+<footer id="page-footer"><div class="footer-content"><ul class="footer-links">
+<li><a href="https://lms.example.edu/admin/tool/dataprivacy/summary.php">Data retention summary</a></li>
+<li><a href="https://download.moodle.org/mobile">Get the mobile app</a></li>
+</ul></div></footer>
+</body></html>
+"""
+
+
+def _activity(rng, course_id, index):
+    kind = rng.choice(ACTIVITY_KINDS)
+    cmid = course_id * 100000 + index
+    title = f"{rng.choice(TITLE_WORDS)} {index} - {rng.choice(TITLE_WORDS)}"
+    desc = ""
+    if rng.random() < 0.3:
+        desc = f"<p>{html.escape(rng.choice(TITLE_WORDS))} material for week {index % 15 + 1}</p>"
+    return {"modname": kind, "cmid": cmid, "title": title, "description": desc}
+
+
+def _notice(rng, course_id, index, big_labels):
+    cmid = course_id * 100000 + index
+    filler = ""
+    if big_labels:
+        # Labels with pasted images are a common cause of multi-megabyte course pages
+        filler = f'<p><img src="data:image/png;base64,{"iVBORw0KGgo" * rng.randint(2000, 6000)}" alt=""></p>'
+    description = (
+        f"<h6><span>Notice {index}:</span> <span>{html.escape(rng.choice(TITLE_WORDS))} moved to week {index % 15 + 1}</span></h6>"
+        f"{filler}"
+    )
+    return {"modname": "label", "cmid": cmid, "title": f"Notice {index}", "description": description}
+
+
+def course_title(course_id):
+    return f"CS{1000 + course_id % 9000} - Course {course_id}"
+
+
+def course_model(course_id, n_sections=12, n_activities=8, seed=None, big_labels=False, changed_items=0, title=None):
+    """Return the content of a synthetic course as a dict.
+
+    {"title", "sesskey", "sections": [{"section": number, "name", "modules": [...]}]}
+    where section 0 holds the general activities and every module is
+    {"modname", "cmid", "title", "description"} ("label" modules are notices).
+    The same (course_id, n_sections, n_activities, seed) always gives the same
+    content. changed_items appends that many extra activities to the last
+    section, which is how the benchmarks model "N items changed" variants.
+    """
+    rng = random.Random(seed if seed is not None else course_id)
+    model = {
+        "title": title or course_title(course_id),
+        "sesskey": "%010x" % rng.getrandbits(40),
+        "sections": [],
+    }
+    index = 0
+    general = []
+    for _ in range(2):
+        index += 1
+        general.append(_activity(rng, course_id, index))
+    model["sections"].append({"section": 0, "name": "General", "modules": general})
+
+    for section_no in range(1, n_sections + 1):
+        modules = []
+        extra = changed_items if section_no == n_sections else 0
+        for _ in range(n_activities + extra):
+            index += 1
+            if rng.random() < 0.15:
+                modules.append(_notice(rng, course_id, index, big_labels))
+            else:
+                modules.append(_activity(rng, course_id, index))
+        model["sections"].append({"section": section_no, "name": f"Week {section_no}", "modules": modules})
+    return model
+
+
+def module_url(module):
+    return f"https://lms.example.edu/mod/{module['modname']}/view.php?id={module['cmid']}"
+
+
+def _render_module(module):
+    kind = module["modname"]
+    cmid = module["cmid"]
+    if kind == "label":
+        return (
+            f'<li class="activity activity-wrapper label modtype_label" id="module-{cmid}" data-for="cmitem" data-id="{cmid}">'
+            '<div class="activity-item focus-control activityinline"><div class="description">'
+            '<div class="activity-altcontent d-flex"><div class="description-inner">'
+            f"{module['description']}"
+            "</div></div></div></div></li>"
+        )
+    desc = ""
+    if module["description"]:
+        desc = (
+            '<div class="activity-altcontent"><div class="description"><div class="no-overflow">'
+            f"{module['description']}"
+            "</div></div></div>"
+        )
+    return (
+        f'<li class="activity activity-wrapper {kind} modtype_{kind}" id="module-{cmid}" data-for="cmitem" data-id="{cmid}">'
+        '<div class="activity-item focus-control" data-activityname="x" data-region="activity-card">'
+        '<div class="activity-grid"><div class="activity-icon activityiconcontainer courseicon align-self-start mr-3">'
+        f'<img src="https://lms.example.edu/theme/image.php/boost/{kind}/1/monologo" class="activityicon" alt=""></div>'
+        '<div class="activity-name-area activity-instance d-flex flex-column mr-2"><div class="activitytitle modtype_resource position-relative align-self-start">'
+        f'<div class="activityname"><a href="{module_url(module)}" class="aalink stretched-link">'
+        f'<span class="instancename">{html.escape(module["title"])} <span class="accesshide "> {kind.title()}</span></span></a></div>'
+        "</div></div>"
+        f"{desc}"
+        "</div></div></li>"
+    )
+
+
+def render_course_page(course_id, n_sections=12, n_activities=8, seed=None, big_labels=False,
+                       changed_items=0, title=None):
+    """Return the HTML of a synthetic course page (see course_model for the arguments)."""
+    model = course_model(course_id, n_sections, n_activities, seed, big_labels, changed_items, title)
+    parts = [PAGE_HEAD.format(title=html.escape(model["title"]), sesskey=model["sesskey"])]
+    general, *sections = model["sections"]
+    parts.append('<div class="course-section-header"><ul class="general-section-activities">')
+    parts.extend(_render_module(module) for module in general["modules"])
+    parts.append("</ul></div>")
+
+    parts.append('<ul class="topics">')
+    for section in sections:
+        section_no = section["section"]
+        parts.append(
+            f'<li id="section-{section_no}" class="section course-section main clearfix" data-sectionid="{section_no}">'
+            f'<div class="course-section-header"><h3 class="sectionname course-content-item"><a href="#section-{section_no}">'
+            f"{section['name']}</a></h3></div>"
+            '<div class="content"><ul class="section m-0 p-0 img-text" data-for="cmlist">'
+        )
+        parts.extend(_render_module(module) for module in section["modules"])
+        parts.append("</ul></div></li>")
+    parts.append("</ul>")
+    parts.append(PAGE_TAIL)
+    return "".join(parts)
+
+
+def render_course_contents(course_id, n_sections=12, n_activities=8, seed=None, big_labels=False,
+                           changed_items=0, title=None):
+    """Return the same course as a core_course_get_contents web service response (a list of sections)."""
+    model = course_model(course_id, n_sections, n_activities, seed, big_labels, changed_items, title)
+    contents = []
+    for section in model["sections"]:
+        modules = []
+        for module in section["modules"]:
+            entry = {
+                "id": module["cmid"], "name": module["title"], "instance": module["cmid"],
+                "modname": module["modname"], "modplural": module["modname"] + "s",
+                "visible": 1, "uservisible": True, "visibleoncoursepage": 1, "noviewlink": module["modname"] == "label",
+            }
+            if module["modname"] != "label":
+                entry["url"] = module_url(module)
+            if module["description"]:
+                entry["description"] = module["description"]
+            modules.append(entry)
+        contents.append({
+            "id": course_id * 1000 + section["section"], "name": section["name"], "visible": 1, "summary": "",
+            "summaryformat": 1, "section": section["section"], "hiddenbynumsections": 0, "uservisible": True,
+            "modules": modules,
+        })
+    return contents
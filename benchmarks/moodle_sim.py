@@ -0,0 +1,246 @@
+"""Local stand-in for a Moodle LMS, for load and scaling tests of the scraper.
+
+Usage:
+    python benchmarks/moodle_sim.py [--courses N] [--host 127.0.0.1] [--port 8765]
+                                    [--latency 0.05] [--jitter 0.5] [--error-rate 0.01]
+                                    [--login-rate 0] [--change-interval 300]
+                                    [--sections 10] [--activities 6] [--seed 0] [--ws-token TOKEN]
+
+Serves /course/view.php?id=1..N with pages from moodle_pages.render_course_page()
+(li.section.main sections of li.activity items with .instancename/a.aalink
+links, as parse_course_page() expects). Each response is delayed by --latency
+seconds (+/- the --jitter fraction) and fails with a 503 at --error-rate.
+Requests without a MoodleSession cookie, and a random --login-rate share of
+the others, are redirected to /login/index.php like an expired session.
+
+The same courses are available as JSON from the web service REST endpoint,
+POST /webservice/rest/server.php with wstoken=--ws-token (default
+"sim-token"): core_course_get_contents, core_course_get_courses_by_field,
+core_course_get_updates_since (the simulated changes since a time) and
+tool_mobile_call_external_functions to batch several of them in one request.
+Latency and errors apply there too; a wrong token gets Moodle's invalidtoken
+error object.
+
+A course starts changing once it has been served: on average every
+--change-interval seconds (exponentially distributed, 0 = never) one activity
+is added to its last section. GET /sim/stats returns the request counters and
+every change as [course_id, version, changed_at (unix time)], which
+benchmarks/load_sim.py turns into time-to-notify figures.
+
+Point the scraper at it with LMS_BASE_URL=http://127.0.0.1:8765 (course URLs
+keep their real host) and any MoodleSession value in cookies.json, plus
+MOODLE_WS_TOKEN=sim-token to use the web service instead of the pages.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+from moodle_pages import course_title, render_course_contents, render_course_page
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><title>Log in to the site</title></head>
+<body id="page-login-index" class="path-login"><div id="page" class="container-fluid">
+<h1 class="login-heading">Log in to Moodle</h1>
+<form class="login-form" action="/login/index.php" method="post" id="login">
+<input type="text" name="username" id="username"><input type="password" name="password" id="password">
+<button type="submit" class="btn btn-primary btn-lg" id="loginbtn">Log in</button>
+</form></div></body></html>
+"""
+
+
+class MoodleSim:
+    """Course pages, their change history and the request counters of one simulator run."""
+
+    def __init__(self, courses, change_interval=300.0, n_sections=10, n_activities=6, seed=0):
+        self.courses = courses
+        self.change_interval = change_interval
+        self.n_sections = n_sections
+        self.n_activities = n_activities
+        self.rng = random.Random(seed)
+        self.versions = {}  # course_id -> number of changes so far
+        self.next_change = {}  # course_id -> unix time of its next change
+        self.changes = []  # (course_id, version, changed_at)
+        self.change_times = {}  # course_id -> [changed_at of version 1, 2, ...]
+        self.stats = {"requests": 0, "pages": 0, "ws_calls": 0, "errors": 0, "login_redirects": 0, "not_found": 0}
+
+    def version(self, course_id, now):
+        """Apply the changes that are due for course_id and return its current version."""
+        version = self.versions.get(course_id, 0)
+        if self.change_interval <= 0:
+            return version
+        # Changes are generated lazily, on the next request after they are due
+        next_change = self.next_change.get(course_id)
+        if next_change is None:
+            next_change = now + self.rng.expovariate(1 / self.change_interval)
+        while next_change <= now:
+            version += 1
+            self.changes.append((course_id, version, next_change))
+            self.change_times.setdefault(course_id, []).append(next_change)
+            next_change += self.rng.expovariate(1 / self.change_interval)
+        self.versions[course_id] = version
+        self.next_change[course_id] = next_change
+        return version
+
+    def page(self, course_id, now):
+        return render_course_page(
+            course_id, n_sections=self.n_sections, n_activities=self.n_activities,
+            changed_items=self.version(course_id, now),
+        ).encode("utf-8")
+
+    def contents(self, course_id, now):
+        return render_course_contents(
+            course_id, n_sections=self.n_sections, n_activities=self.n_activities,
+            changed_items=self.version(course_id, now),
+        )
+
+    def course_id(self, value):
+        """The course id in value if such a course exists, else None."""
+        try:
+            course_id = int(value)
+        except (TypeError, ValueError):
+            return None
+        return course_id if 1 <= course_id <= self.courses else None
+
+
+class WebServiceError(Exception):
+    """A Moodle web service error, returned to the client as {"exception", "errorcode", "message"}."""
+
+    def __init__(self, errorcode, message, exception="moodle_exception"):
+        super().__init__(message)
+        self.reply = {"exception": exception, "errorcode": errorcode, "message": message}
+
+
+def missing_record(table):
+    return WebServiceError("invalidrecord", f"Can't find data record in database table {table}.",
+                           "dml_missing_record_exception")
+
+
+def build_app(sim, latency=0.05, jitter=0.5, error_rate=0.01, login_rate=0.0, ws_token="sim-token"):
+    rng = random.Random()
+
+    async def delay_or_fail():
+        """Apply the simulated latency; returns a 503 response for the requests that should fail."""
+        sim.stats["requests"] += 1
+        if latency > 0:
+            await asyncio.sleep(latency * rng.uniform(1 - jitter, 1 + jitter))
+        if rng.random() < error_rate:
+            sim.stats["errors"] += 1
+            return web.Response(status=503, text="Service temporarily unavailable")
+        return None
+
+    async def course_view(request):
+        failed = await delay_or_fail()
+        if failed is not None:
+            return failed
+        if not request.cookies.get("MoodleSession") or rng.random() < login_rate:
+            sim.stats["login_redirects"] += 1
+            raise web.HTTPSeeOther("/login/index.php")
+        course_id = sim.course_id(request.query.get("id"))
+        if course_id is None:
+            sim.stats["not_found"] += 1
+            return web.Response(status=404, text="Can't find data record in database table course.")
+        sim.stats["pages"] += 1
+        return web.Response(body=sim.page(course_id, time.time()), content_type="text/html", charset="utf-8")
+
+    def course_arg(args, key):
+        course_id = sim.course_id(args.get(key))
+        if course_id is None:
+            sim.stats["not_found"] += 1
+            raise missing_record("course")
+        return course_id
+
+    def run_function(function, args):
+        """JSON-ready result of one web service function; raises WebServiceError like Moodle would."""
+        now = time.time()
+        if function == "core_course_get_contents":
+            return sim.contents(course_arg(args, "courseid"), now)
+        if function == "core_course_get_courses_by_field":
+            course_id = sim.course_id(args.get("value")) if args.get("field") == "id" else None
+            courses = []
+            if course_id is not None:
+                title = course_title(course_id)
+                courses.append({"id": course_id, "fullname": title, "shortname": title.split(" - ")[0]})
+            return {"courses": courses, "warnings": []}
+        if function == "core_course_get_updates_since":
+            course_id = course_arg(args, "courseid")
+            since = int(args.get("since", 0))
+            version = sim.version(course_id, now)
+            # Every change adds an activity to the last section: report those modules as created
+            instances = [
+                {"contextlevel": "module", "id": course_id * 100000 + 90000 + changed_version,
+                 "updates": [{"name": "configuration", "timeupdated": int(changed_at)}]}
+                for changed_version, changed_at in enumerate(sim.change_times.get(course_id, ()), 1)
+                if changed_version <= version and int(changed_at) >= since
+            ]
+            return {"instances": instances, "warnings": []}
+        if function == "tool_mobile_call_external_functions":
+            responses = []
+            index = 0
+            while f"requests[{index}][function]" in args:
+                try:
+                    data = run_function(args[f"requests[{index}][function]"],
+                                        json.loads(args.get(f"requests[{index}][arguments]") or "{}"))
+                    responses.append({"error": False, "data": json.dumps(data)})
+                except WebServiceError as e:
+                    responses.append({"error": True, "exception": json.dumps(e.reply)})
+                index += 1
+            return {"responses": responses}
+        raise missing_record(f"external_functions. ({function})")
+
+    async def web_service(request):
+        failed = await delay_or_fail()
+        if failed is not None:
+            return failed
+        form = await request.post()
+        if form.get("wstoken") != ws_token:
+            return web.json_response(WebServiceError("invalidtoken", "Invalid token - token not found").reply)
+        sim.stats["ws_calls"] += 1
+        try:
+            result = run_function(form.get("wsfunction"), form)
+        except WebServiceError as e:
+            result = e.reply
+        return web.Response(text=json.dumps(result), content_type="application/json")
+
+    async def login(request):
+        return web.Response(text=LOGIN_PAGE, content_type="text/html", charset="utf-8")
+
+    async def stats(request):
+        return web.json_response({**sim.stats, "courses": sim.courses, "changes": sim.changes})
+
+    app = web.Application()
+    app.router.add_get("/course/view.php", course_view)
+    app.router.add_get("/login/index.php", login)
+    app.router.add_post("/webservice/rest/server.php", web_service)
+    app.router.add_get("/sim/stats", stats)
+    return app
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--courses", type=int, default=1000)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every course response")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency varies by this fraction either way")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="share of course requests answered with 503")
+    parser.add_argument("--login-rate", type=float, default=0.0, help="share of course requests sent to the login page")
+    parser.add_argument("--change-interval", type=float, default=300.0,
+                        help="mean seconds between changes of one course (0 = never)")
+    parser.add_argument("--sections", type=int, default=10)
+    parser.add_argument("--activities", type=int, default=6, help="activities per section")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ws-token", default="sim-token", help="token the web service endpoint accepts")
+    args = parser.parse_args()
+
+    sim = MoodleSim(args.courses, args.change_interval, args.sections, args.activities, args.seed)
+    app = build_app(sim, args.latency, args.jitter, args.error_rate, args.login_rate, args.ws_token)
+    print(f"Simulating {args.courses} courses on http://{args.host}:{args.port}/course/view.php?id=1", flush=True)
+    web.run_app(app, host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main_()
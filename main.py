@@ -1,31 +1,91 @@
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import json
 import re
 import time
+import random
 import hashlib
 import os
+import sys
 from dotenv import load_dotenv
 from datetime import datetime, timezone
-import urllib3
 import logging
+import logging.handlers
+import queue
+import atexit
 import threading
 import io
+import sqlite3
+import codecs
+from html.parser import HTMLParser
 import asyncio
+import contextlib
+import functools
+import signal
+import heapq
+import bisect
+import socket
+import multiprocessing
+import urllib.parse
+import email.utils
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import aiohttp
+from aiohttp import web
 import discord
 from discord import app_commands
 from discord.ext import commands
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.StreamHandler(),  # Log to console
-        logging.FileHandler("scraper.log", encoding="utf-8")  # Optional: log to file
-    ]
-)
+try:
+    import xxhash
+except ImportError:  # optional: faster hashing, blake2b from hashlib is used otherwise
+    xxhash = None
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler with nothing but a queue put on the logging call path.
+
+    Records only cross threads here (never processes), so they are enqueued
+    as-is: no handler lock and no formatting. Formatting happens on the
+    listener thread.
+    """
+    def handle(self, record):
+        rv = self.filter(record)
+        if isinstance(rv, logging.LogRecord):
+            record = rv
+        if rv:
+            self.emit(record)
+        return rv
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    def prepare(self, record):
+        return record
+
+
+load_dotenv()
+# Log file in the working directory; empty to log only to the console (the benchmarks do)
+LOG_FILE = os.getenv("LOG_FILE", "scraper.log")
+
+# Every log call only puts the record on log_queue; log_listener's thread writes
+# it to the console, LOG_FILE and (once installed) the Discord log channel
+log_queue = queue.SimpleQueue()
+_log_format = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+# (parent_process() is not set yet while a spawned child re-imports the main module; its name is)
+if multiprocessing.current_process().name == "MainProcess":
+    _log_outputs = [logging.StreamHandler()]  # Log to console
+    if LOG_FILE:
+        _log_outputs.append(logging.FileHandler(LOG_FILE, encoding="utf-8"))
+    for _handler in _log_outputs:
+        _handler.setFormatter(_log_format)
+    log_listener = logging.handlers.QueueListener(log_queue, *_log_outputs, respect_handler_level=True)
+    logging.basicConfig(level=logging.INFO, handlers=[_NonBlockingQueueHandler(log_queue)])
+    log_listener.start()
+    atexit.register(log_listener.stop)
+else:
+    # A parse_pool worker re-importing this module (spawn): the parent owns the
+    # listener and LOG_FILE, so workers only report warnings to the console
+    log_listener = None
+    _console = logging.StreamHandler()
+    _console.setFormatter(_log_format)
+    logging.basicConfig(level=logging.WARNING, handlers=[_console])
 
 # Try to load initial course list
 try:
@@ -36,7 +96,6 @@ except FileNotFoundError:
     COURSE_URLS = []
     MISSING_COURSE_URLS = True
 
-load_dotenv()
 DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
 DISCORD_NOTIFY_CHANNEL_ID = os.getenv("DISCORD_NOTIFY_CHANNEL_ID")
 DISCORD_LOG_CHANNEL_ID = os.getenv("DISCORD_LOG_CHANNEL_ID")
@@ -45,6 +104,76 @@ DISCORD_LOG_LEVEL = os.getenv("DISCORD_LOG_LEVEL", "WARNING").upper()
 DISCORD_LOG_HANDLER = None
 ADMIN_ROLE_NAME = os.getenv("DISCORD_ADMIN_ROLE", "course-admin")
 WHITELISTED_IDS = set([s.strip() for s in os.getenv("DISCORD_WHITELISTED_IDS", "").split(",") if s.strip()])
+# Max number of courses scraped at the same time, and max open fetches per LMS host
+SCRAPE_CONCURRENCY = max(1, int(os.getenv("SCRAPE_CONCURRENCY", "8")))
+SCRAPE_PER_HOST_LIMIT = max(1, int(os.getenv("SCRAPE_PER_HOST_LIMIT", "4")))
+# HTTP client: timeouts in seconds, retries for 5xx/connection errors with exponential backoff + jitter
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_MAX_RETRIES = max(0, int(os.getenv("HTTP_MAX_RETRIES", "3")))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "1"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "30"))
+LMS_VERIFY_TLS = os.getenv("LMS_VERIFY_TLS", "false").strip().lower() in ("1", "true", "yes")
+# Fetch course pages from this scheme://host instead of the one in each course URL (e.g. a local
+# stand-in LMS such as benchmarks/moodle_sim.py); course ids and stored state are unaffected
+LMS_BASE_URL = os.getenv("LMS_BASE_URL", "").strip().rstrip("/")
+# Moodle web service token: when set, course contents come from core_course_get_contents as JSON
+# instead of the rendered course page. The REST endpoint defaults to <site>/webservice/rest/server.php
+# of each course URL; MOODLE_WS_URL overrides it
+MOODLE_WS_TOKEN = os.getenv("MOODLE_WS_TOKEN", "").strip()
+MOODLE_WS_URL = os.getenv("MOODLE_WS_URL", "").strip()
+# Change feed (needs MOODLE_WS_TOKEN): every CHANGE_FEED_INTERVAL seconds one batched web service call
+# asks which courses changed and only those are scraped; the rest are swept every POLL_MAX_INTERVAL (0 = off)
+CHANGE_FEED_INTERVAL = float(os.getenv("CHANGE_FEED_INTERVAL", "0"))
+CHANGE_FEED_BATCH_SIZE = max(1, int(os.getenv("CHANGE_FEED_BATCH_SIZE", "200")))
+# Adaptive polling: per-course interval in seconds, shortened after a change and stretched while quiet
+POLL_BASE_INTERVAL = float(os.getenv("POLL_BASE_INTERVAL", "120"))
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "60"))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "1800"))
+POLL_BACKOFF_FACTOR = float(os.getenv("POLL_BACKOFF_FACTOR", "1.5"))
+# A failed poll is retried after this many seconds, doubling per consecutive failure up to the course's interval
+POLL_ERROR_RETRY = float(os.getenv("POLL_ERROR_RETRY", "15"))
+# Global request budget across all courses (requests per second, 0 = unlimited)
+POLL_MAX_RPS = float(os.getenv("POLL_MAX_RPS", "5"))
+# Which change kinds from diff_course_data are posted to Discord (added, removed, modified, moved)
+NOTIFY_CHANGE_KINDS = set(s.strip().lower() for s in os.getenv("NOTIFY_CHANGE_KINDS", "added,modified").split(",") if s.strip())
+# Where per-course state is kept: "sqlite" (incremental, crash-safe) or "json" (scraper_state.json)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite").strip().lower()
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "scraper_state.db")
+STATE_JSON_PATH = "scraper_state.json"
+# HTML parser backend for course pages: html.parser, lxml, strainer, lxml-strainer
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "html.parser").strip().lower()
+# Streaming mode parses course pages section by section while they download (bounded memory)
+STREAMING_PARSE = os.getenv("STREAMING_PARSE", "false").strip().lower() in ("1", "true", "yes")
+STREAM_CHUNK_SIZE = max(1024, int(os.getenv("STREAM_CHUNK_SIZE", "65536")))
+# Optional JSON rule table for activity categories (see ActivityClassifier); built-in rules otherwise
+CLASSIFIER_RULES_PATH = os.getenv("CLASSIFIER_RULES_PATH", "classifier_rules.json")
+# Worker processes that parse course pages (0 = parse on a thread pool in the main process)
+PARSE_WORKERS = max(0, int(os.getenv("PARSE_WORKERS", "0")))
+# Sharding: workers started with distinct SHARD_WORKER_IDs split the course list between them
+SHARD_WORKER_ID = os.getenv("SHARD_WORKER_ID", "").strip()
+SHARD_COORDINATOR_PATH = os.getenv("SHARD_COORDINATOR_PATH", STATE_DB_PATH)
+SHARD_HEARTBEAT_INTERVAL = float(os.getenv("SHARD_HEARTBEAT_INTERVAL", "5"))
+# A worker whose heartbeat is older than this is considered dead and its courses move
+SHARD_LEASE_TIMEOUT = float(os.getenv("SHARD_LEASE_TIMEOUT", "30"))
+SHARD_VNODES = max(1, int(os.getenv("SHARD_VNODES", "64")))
+# Notification dispatcher: queue bound, how long to gather a burst before sending, Discord pacing
+NOTIFY_QUEUE_SIZE = max(1, int(os.getenv("NOTIFY_QUEUE_SIZE", "1000")))
+NOTIFY_BATCH_DELAY = float(os.getenv("NOTIFY_BATCH_DELAY", "2"))
+NOTIFY_MESSAGES_PER_5S = max(1, int(os.getenv("NOTIFY_MESSAGES_PER_5S", "4")))
+# Durable outbox for notifications: a table in the state database, or notifications.db with the JSON store
+OUTBOX_DB_PATH = os.getenv("OUTBOX_DB_PATH", STATE_DB_PATH if STATE_BACKEND == "sqlite" else "notifications.db")
+OUTBOX_MAX_ATTEMPTS = max(1, int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10")))
+# Discord log forwarding: how often buffered records are flushed and how many are kept (oldest dropped first)
+DISCORD_LOG_FLUSH_INTERVAL = float(os.getenv("DISCORD_LOG_FLUSH_INTERVAL", "2"))
+DISCORD_LOG_QUEUE_SIZE = max(1, int(os.getenv("DISCORD_LOG_QUEUE_SIZE", "500")))
+# How long (seconds) a cached authorization decision is trusted without a member/role event
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+# How often (seconds) cookies.json / course_urls.json are stat()ed for outside edits
+CONFIG_CHECK_INTERVAL = float(os.getenv("CONFIG_CHECK_INTERVAL", "2"))
+# Prometheus-style /metrics endpoint (0 = disabled); bound to localhost unless METRICS_HOST says otherwise
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
 
 # Load cookies
 try:
@@ -58,16 +187,77 @@ except FileNotFoundError:
     cookies = {}
 
 
-def read_cookies():
-    """Thread-safe read of cookies.json. Returns a dict usable by requests."""
-    with file_lock:
+class CachedJsonFile:
+    """In-memory copy of a small JSON config file, reloaded only when the file changes.
+
+    get() serves the cached value and at most every check_interval seconds
+    stat()s the file; it is re-read (under file_lock) only when its inode,
+    mtime or size differ from the last load. write() updates the file and the
+    cache together, so changes made through slash commands are visible at once.
+    """
+    def __init__(self, path, transform, default, check_interval=CONFIG_CHECK_INTERVAL):
+        self.path = path
+        self.transform = transform
+        self.default = default
+        self.check_interval = check_interval
+        self._value = transform(default)
+        self._signature = None
+        self._next_check = 0.0
+
+    def _stat_signature(self):
         try:
-            with open('cookies.json', 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            val = data.get('value') if isinstance(data, dict) else None
-            return {"MoodleSession": val} if val else {}
+            st = os.stat(self.path)
         except FileNotFoundError:
-            return {}
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def get(self):
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            signature = self._stat_signature()
+            if signature != self._signature:
+                self._reload()
+        return self._value
+
+    def _reload(self):
+        with file_lock:
+            signature = self._stat_signature()
+            if signature is None:
+                self._value = self.transform(self.default)
+            else:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self._value = self.transform(json.load(f))
+                except (OSError, ValueError) as e:
+                    # Keep serving the last good value until the file changes again
+                    logging.error(f"Failed to reload {self.path}; keeping the cached value: {e}")
+            self._signature = signature
+
+    def write(self, data):
+        """Write data to the file (caller holds file_lock) and refresh the cache."""
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        self._value = self.transform(data)
+        self._signature = self._stat_signature()
+
+    def invalidate(self):
+        self._next_check = 0.0
+        self._signature = ()
+
+
+def _cookies_from_json(data):
+    val = data.get('value') if isinstance(data, dict) else None
+    return {"MoodleSession": val} if val else {}
+
+
+def _course_urls_from_json(data):
+    return list(data) if isinstance(data, list) else []
+
+
+def read_cookies():
+    """Cached read of cookies.json. Returns a dict with the MoodleSession cookie."""
+    return cookies_cache.get()
 
 
 def is_cookie_full_shape(obj) -> bool:
@@ -103,8 +293,7 @@ def write_cookies(value: str):
                 try:
                     parsed = json.loads(s)
                     if isinstance(parsed, dict):
-                        with open('cookies.json', 'w', encoding='utf-8') as f:
-                            json.dump(parsed, f, indent=2, ensure_ascii=False)
+                        cookies_cache.write(parsed)
                         return
                 except json.JSONDecodeError:
                     raise ValueError("Provided cookie string is not valid JSON")
@@ -118,31 +307,210 @@ headers = {
     "User-Agent": "Mozilla/5.0"
 }
 
-try:
-    with open("scraper_state.json", "r", encoding="utf-8") as f:
-        previous_data = json.load(f)
-except FileNotFoundError:
-    previous_data = {}
+# Per-course scraper state, loaded from the configured state store in main()
+previous_data = {}
+# Guards previous_data entries and the dirty/history bookkeeping below
+state_lock = threading.Lock()
 
 # Lock to coordinate file access between scraper and bot commands
 file_lock = threading.Lock()
 
 
+cookies_cache = CachedJsonFile('cookies.json', _cookies_from_json, None)
+course_urls_cache = CachedJsonFile("course_urls.json", _course_urls_from_json, [])
+
+
 def read_course_urls():
-    """Thread-safe read of course_urls.json returning a list."""
-    with file_lock:
-        try:
-            with open("course_urls.json", "r", encoding="utf-8") as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return []
+    """Cached read of course_urls.json returning a list (a copy callers may modify)."""
+    return list(course_urls_cache.get())
 
 
 def write_course_urls(urls):
     """Thread-safe write of course_urls.json."""
     with file_lock:
-        with open("course_urls.json", "w", encoding="utf-8") as f:
-            json.dump(urls, f, indent=2, ensure_ascii=False)
+        course_urls_cache.write(urls)
+
+
+class _Metric:
+    """Base for the metric types below: one value per combination of label values."""
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = list(self._children.items())
+        for values, value in children:
+            lines.extend(self._render_child(values, value))
+        return lines
+
+    def snapshot(self):
+        """Return {label values: value} for every child."""
+        with self._lock:
+            return dict(self._children)
+
+    def _render_child(self, values, value):
+        return [f"{self.name}{self._label_text(values)} {value:g}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._children[labels] = self._children.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that is set directly, or read from a callback when rendered."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), function=None):
+        super().__init__(name, help_text, labels)
+        self.function = function
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._children[labels] = value
+
+    def render(self):
+        if self.function is not None:
+            try:
+                self.set(self.function())
+            except Exception:
+                logging.debug(f"Gauge {self.name} callback failed", exc_info=True)
+        return super().render()
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram with p50/p95 estimates (interpolated like histogram_quantile)."""
+    kind = "histogram"
+    LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            child = self._children.get(labels)
+            if child is None:
+                # [per-bucket counts..., +Inf count], sum
+                child = self._children[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            child[0][bisect.bisect_left(self.buckets, value)] += 1
+            child[1] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: (list(counts), total) for labels, (counts, total) in self._children.items()}
+
+    def quantile(self, q, *labels):
+        """Estimate the q-quantile from the buckets; None if nothing was observed."""
+        counts, _ = self.snapshot().get(labels, (None, 0))
+        if not counts or not sum(counts):
+            return None
+        rank = q * sum(counts)
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def _render_child(self, values, value):
+        counts, total = value
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f"{self.name}_bucket{self._label_text(values, [('le', le)])} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(values)} {total:g}")
+        lines.append(f"{self.name}_count{self._label_text(values)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """The metrics served on /metrics in the Prometheus text format."""
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+STAGES = ("dns", "connect", "ttfb", "download", "parse", "hash", "state_read", "diff", "state_write", "notify_send")
+# dns/connect/ttfb/download come from aiohttp tracing; the other stages are timed in place
+STAGE_SECONDS = metrics.register(Histogram(
+    "lms_scraper_stage_seconds", "Time spent per pipeline stage.", ["stage"]))
+NOTIFY_LATENCY_SECONDS = metrics.register(Histogram(
+    "lms_scraper_notify_latency_seconds", "Time from fetching a page to posting its change notification."))
+COURSES_TOTAL = metrics.register(Counter(
+    "lms_scraper_courses_total", "Course polls by outcome.", ["outcome"]))
+CHANGES_TOTAL = metrics.register(Counter(
+    "lms_scraper_changes_total", "Detected item changes by kind.", ["kind"]))
+NOTIFICATIONS_TOTAL = metrics.register(Counter(
+    "lms_scraper_notifications_total", "Notification items by delivery result.", ["result"]))
+COURSES_IN_FLIGHT = metrics.register(Gauge(
+    "lms_scraper_courses_in_flight", "Course polls currently running."))
+COURSES_TRACKED = metrics.register(Gauge(
+    "lms_scraper_courses_tracked", "Courses with state held by this process.", function=lambda: len(previous_data)))
+DISCORD_LOG_DROPPED = metrics.register(Counter(
+    "lms_scraper_discord_log_dropped_total", "Log records dropped because the Discord log buffer was full."))
+DISCORD_LOG_DROPPED.inc(amount=0)  # exported as 0 until the first drop
+
+
+def format_stage_stats():
+    """Plain-text table of per-stage count/p50/p95 and the main counters, for /stats."""
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.1f}ms"
+
+    children = STAGE_SECONDS.snapshot()
+    lines = [f"{'stage':<12}{'count':>8}{'p50':>12}{'p95':>12}"]
+    for stage in STAGES:
+        counts, _ = children.get((stage,), ([0], 0))
+        lines.append(f"{stage:<12}{sum(counts):>8}{ms(STAGE_SECONDS.quantile(0.5, stage)):>12}"
+                     f"{ms(STAGE_SECONDS.quantile(0.95, stage)):>12}")
+    latency_p50 = NOTIFY_LATENCY_SECONDS.quantile(0.5)
+    latency_p95 = NOTIFY_LATENCY_SECONDS.quantile(0.95)
+    lines.append(f"{'fetch→notify':<12}{'':>8}{ms(latency_p50):>12}{ms(latency_p95):>12}")
+    outcomes = ", ".join(f"{labels[0]} {int(value)}" for labels, value in sorted(COURSES_TOTAL.snapshot().items()))
+    changes = ", ".join(f"{labels[0]} {int(value)}" for labels, value in sorted(CHANGES_TOTAL.snapshot().items()))
+    lines.append("")
+    lines.append(f"polls: {outcomes or 'none yet'}")
+    lines.append(f"changes: {changes or 'none yet'}")
+    return "\n".join(lines)
 
 
 intents = discord.Intents.default()
@@ -154,38 +522,114 @@ bot = commands.Bot(command_prefix=[], intents=intents)
 class DiscordLogHandler(logging.Handler):
     """Logging handler that posts log records to a Discord channel asynchronously.
 
-    It enqueues formatted log messages and a background coroutine on the bot loop will
-    pull from the queue and send them to the configured channel. This avoids blocking
-    the main thread or bot event loop directly from the logging call site.
+    It is attached to log_listener, so emit() runs on the listener thread and
+    only appends to a bounded buffer (a full buffer drops its oldest record and
+    counts it in dropped_total). Every DISCORD_LOG_FLUSH_INTERVAL
+    seconds a background coroutine on the event loop drains the whole buffer,
+    collapses repeated messages into one line with a count ("×37"), packs the
+    lines into one embed per level and sends up to 10 embeds per message.
     """
-    def __init__(self, bot, level=logging.WARNING):
+    # Discord limits: 4096 chars per embed description, 6000 per message, 10 embeds per message
+    MAX_DESC = 3800
+    MAX_MESSAGE_CHARS = 5800
+    MAX_EMBEDS = 10
+    COLORS = {
+        logging.DEBUG: 0x99AAB5,    # grey
+        logging.INFO: 0x57F287,     # green
+        logging.WARNING: 0xFAA61A,  # orange
+        logging.ERROR: 0xED4245,    # red
+        logging.CRITICAL: 0x732FCE  # purple
+    }
+
+    def __init__(self, bot, level=logging.WARNING, max_queue=DISCORD_LOG_QUEUE_SIZE,
+                 flush_interval=DISCORD_LOG_FLUSH_INTERVAL):
         super().__init__(level=level)
         self.bot = bot
-        self.queue = asyncio.Queue()
+        self.flush_interval = flush_interval
+        self.buffer = deque(maxlen=max_queue)
+        self.dropped_total = 0
+        self._dropped_unreported = 0
         self._task = None
 
     def emit(self, record: logging.LogRecord) -> None:
         try:
             msg = self.format(record)
-            # Enqueue without blocking
-            try:
-                self.queue.put_nowait((record.levelno, msg))
-            except Exception:
-                # If queue put fails for any reason, fallback to console
-                print(msg)
-            # Ensure background sender is scheduled when bot loop is available
-            if self._task is None and self.bot and getattr(self.bot, 'loop', None):
-                try:
-                    # schedule the background sender on the bot loop
-                    self._task = asyncio.run_coroutine_threadsafe(self._sender(), self.bot.loop)
-                except Exception:
-                    # If the loop isn't running yet, ignore — sender will be started from on_ready
-                    pass
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped_total += 1
+                self._dropped_unreported += 1
+                DISCORD_LOG_DROPPED.inc()
+            # deque.append is atomic; with maxlen it discards the oldest entry
+            self.buffer.append((record.levelno, record.created, msg))
         except Exception:
             self.handleError(record)
 
+    def start(self):
+        """Start the sender coroutine; must run on the event loop (from on_ready)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sender())
+
+    def _drain(self):
+        """Pop everything buffered and collapse duplicates.
+
+        Returns [(levelno, first_created, msg, count)] in order of first appearance.
+        """
+        merged = {}
+        while self.buffer:
+            levelno, created, msg = self.buffer.popleft()
+            key = (levelno, msg)
+            if key in merged:
+                merged[key][3] += 1
+            else:
+                merged[key] = [levelno, created, msg, 1]
+        return [tuple(v) for v in merged.values()]
+
+    def _build_embeds(self, entries):
+        """Pack drained entries into embeds: one or more per level, many lines each."""
+        by_level = {}
+        for levelno, created, msg, count in entries:
+            stamp = datetime.fromtimestamp(created, timezone.utc).strftime("%H:%M:%S")
+            line = f"`{stamp}` {msg}" + (f" **×{count}**" if count > 1 else "")
+            by_level.setdefault(levelno, []).append((line, count))
+
+        embeds = []
+        for levelno, lines in by_level.items():
+            chunks, current, records = [], "", 0
+            for line, count in lines:
+                # A single oversized record (e.g. a long traceback) is split over several embeds
+                pieces = [line[i:i + self.MAX_DESC] for i in range(0, len(line), self.MAX_DESC)] or [""]
+                for piece in pieces:
+                    if current and len(current) + len(piece) + 1 > self.MAX_DESC:
+                        chunks.append((current, records))
+                        current, records = "", 0
+                    current = f"{current}\n{piece}" if current else piece
+                records += count
+            if current:
+                chunks.append((current, records))
+            level_name = logging.getLevelName(levelno)
+            for i, (desc, records) in enumerate(chunks):
+                title = f"[{level_name}]" + (f" ({records} records)" if records > 1 else "")
+                if len(chunks) > 1:
+                    title += f" (part {i + 1})"
+                embed = discord.Embed(title=title, description=desc, color=self.COLORS.get(levelno, 0x5865F2),
+                                      timestamp=datetime.now(timezone.utc))
+                embed.set_footer(text="lms-scraper logs")
+                embeds.append(embed)
+        return embeds
+
+    def _pack_messages(self, embeds):
+        message, chars = [], 0
+        for embed in embeds:
+            size = len(embed)
+            if message and (len(message) >= self.MAX_EMBEDS or chars + size > self.MAX_MESSAGE_CHARS):
+                yield message
+                message, chars = [], 0
+            message.append(embed)
+            chars += size
+        if message:
+            yield message
+
     async def _sender(self):
-        """Background coroutine running on bot loop that sends queued logs to the channel."""
+        """Background coroutine running on the event loop that flushes buffered logs to the channel."""
         # resolve the channel id
         try:
             if not DISCORD_LOG_CHANNEL_ID:
@@ -204,43 +648,21 @@ class DiscordLogHandler(logging.Handler):
                 logging.exception(f"DiscordLogHandler failed to fetch channel {DISCORD_LOG_CHANNEL_ID}")
                 return
 
-        # repeatedly drain queue and send messages
+        # periodically drain the buffer and send what accumulated
         while True:
             try:
-                levelno, msg = await self.queue.get()
-                # Use embed colors per level for readability
-                level_name = logging.getLevelName(levelno)
-                # Map log levels to Discord embed colors
-                color_map = {
-                    logging.DEBUG: 0x99AAB5,    # grey
-                    logging.INFO: 0x57F287,     # green
-                    logging.WARNING: 0xFAA61A,  # orange
-                    logging.ERROR: 0xED4245,    # red
-                    logging.CRITICAL: 0x732FCE  # purple
-                }
-                color = color_map.get(levelno, 0x5865F2)
-
-                # Discord embed description limit is 4096; keep chunks smaller to be safe
-                max_desc = 3800
-                if len(msg) <= max_desc:
-                    embed = discord.Embed(title=f"[{level_name}]", description=msg, color=color, timestamp=datetime.now(timezone.utc))
-                    embed.set_footer(text="lms-scraper logs")
+                await asyncio.sleep(self.flush_interval)
+                if not self.buffer:
+                    continue
+                embeds = self._build_embeds(self._drain())
+                if self._dropped_unreported:
+                    embeds[-1].set_footer(text=f"lms-scraper logs • {self._dropped_unreported} older records dropped")
+                    self._dropped_unreported = 0
+                for message in self._pack_messages(embeds):
                     try:
-                        await channel.send(embed=embed)
+                        await channel.send(embeds=message)
                     except Exception:
                         logging.exception("Failed to send embed log message to Discord channel")
-                else:
-                    # Split into multiple embeds
-                    for i in range(0, len(msg), max_desc):
-                        chunk = msg[i:i+max_desc]
-                        embed = discord.Embed(title=f"[{level_name}] (part {i//max_desc + 1})", description=chunk, color=color, timestamp=datetime.now(timezone.utc))
-                        embed.set_footer(text="lms-scraper logs")
-                        try:
-                            await channel.send(embed=embed)
-                        except Exception:
-                            logging.exception("Failed to send log embed chunk to Discord channel")
-                # small sleep to avoid hitting rate limits when many logs appear
-                await asyncio.sleep(0.25)
             except asyncio.CancelledError:
                 break
             except Exception:
@@ -255,7 +677,7 @@ async def get_log_level(interaction: discord.Interaction):
         logging.info(f"/get_log_level requested by {interaction.user} (id={interaction.user.id}) in guild={guild_id}")
     except Exception:
         pass
-    if not user_is_authorized(interaction.user, interaction.guild):
+    if not await user_is_authorized(interaction.user, interaction.guild):
         await interaction.response.send_message("You are not authorized to use this command.", ephemeral=True)
         return
     level = DISCORD_LOG_LEVEL
@@ -269,7 +691,7 @@ async def set_log_level(interaction: discord.Interaction, level: str):
         logging.info(f"/set_log_level requested by {interaction.user} (id={interaction.user.id}) in guild={guild_id} level={level}")
     except Exception:
         pass
-    if not user_is_authorized(interaction.user, interaction.guild):
+    if not await user_is_authorized(interaction.user, interaction.guild):
         await interaction.response.send_message("You are not authorized to use this command.", ephemeral=True)
         return
     l = level.strip().upper()
@@ -288,17 +710,37 @@ async def set_log_level(interaction: discord.Interaction, level: str):
         await interaction.response.send_message("Failed to set log level. See logs.", ephemeral=True)
 
 
+@bot.tree.command(name="stats", description="Show per-stage timings (p50/p95) and poll counters")
+async def slash_stats(interaction: discord.Interaction):
+    try:
+        guild_id = interaction.guild.id if interaction.guild else 'DM'
+        logging.info(f"/stats requested by {interaction.user} (id={interaction.user.id}) in guild={guild_id}")
+    except Exception:
+        pass
+    if not await user_is_authorized(interaction.user, interaction.guild):
+        await interaction.response.send_message("You are not authorized to use this command.", ephemeral=True)
+        return
+    await interaction.response.send_message(f"```\n{format_stage_stats()}\n```", ephemeral=True)
+
+
 def setup_discord_log_handler():
     if not DISCORD_LOG_CHANNEL_ID:
         logging.info("DISCORD_LOG_CHANNEL_ID not set; Discord log forwarding disabled")
         return
     try:
         global DISCORD_LOG_HANDLER
+        if DISCORD_LOG_HANDLER is not None:
+            # on_ready fires again after reconnects; keep the one handler, just make sure it is sending
+            DISCORD_LOG_HANDLER.start()
+            return
         level = getattr(logging, DISCORD_LOG_LEVEL, logging.WARNING)
         handler = DiscordLogHandler(bot, level=level)
-        fmt = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+        # Time and level are shown per line / per embed, so only the message (and traceback) is formatted
+        fmt = logging.Formatter("%(message)s")
         handler.setFormatter(fmt)
-        logging.getLogger().addHandler(handler)
+        # Attach to the queue listener so it shares the off-thread pipeline with console/file output
+        log_listener.handlers = log_listener.handlers + (handler,)
+        handler.start()
         DISCORD_LOG_HANDLER = handler
         logging.info(f"DiscordLogHandler installed for channel {DISCORD_LOG_CHANNEL_ID} at level {DISCORD_LOG_LEVEL}")
     except Exception:
@@ -317,27 +759,109 @@ def is_valid_course_url(url: str) -> bool:
     return True
 
 
-def user_is_authorized(user: discord.abc.User, guild: discord.Guild | None) -> bool:
-    """Return True if the user is whitelisted or has the admin role in the guild."""
-    try:
+def course_id_from_url(url):
+    """The numeric id parameter of a course URL ("5" for view.php?id=5&section=2#top), or None."""
+    values = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query).get("id")
+    return values[0] if values and values[0].isdigit() else None
+
+
+def course_key(url):
+    """Key of a course in previous_data and the state store: its id, or the whole URL if it has none."""
+    return course_id_from_url(url) or url
+
+
+class AuthorizationService:
+    """Cached answers to "may this user run admin commands in this guild?".
+
+    Whitelisted IDs are checked first. Otherwise the decision is cached per
+    (guild, user) for AUTH_CACHE_TTL seconds; member and role gateway events
+    update or drop cached entries so role changes apply right away. A cache
+    miss uses the interaction's Member or the guild's member cache and only
+    falls back to an awaited fetch_member, so the event loop never blocks.
+    """
+    def __init__(self, ttl=AUTH_CACHE_TTL):
+        self.ttl = ttl
+        self._cache = {}  # guild_id -> {user_id: (authorized, expires_at)}
+
+    @staticmethod
+    def member_is_admin(member) -> bool:
+        return any(role.name == ADMIN_ROLE_NAME for role in member.roles)
+
+    def _store(self, guild_id, user_id, authorized):
+        now = time.monotonic()
+        guild_cache = self._cache.setdefault(guild_id, {})
+        # Drop expired decisions on the way, so users who stopped running commands do not pile up
+        for expired in [uid for uid, (_, expires_at) in guild_cache.items() if expires_at <= now]:
+            del guild_cache[expired]
+        guild_cache[user_id] = (authorized, now + self.ttl)
+        return authorized
+
+    async def is_authorized(self, user: discord.abc.User, guild: discord.Guild | None) -> bool:
         if str(user.id) in WHITELISTED_IDS:
             return True
         if guild is None:
             return False
-        member = guild.get_member(user.id)
+        cached = self._cache.get(guild.id, {}).get(user.id)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+
+        member = user if isinstance(user, discord.Member) and user.guild.id == guild.id else guild.get_member(user.id)
         if member is None:
-            # try fetch
             try:
-                member = asyncio.run_coroutine_threadsafe(guild.fetch_member(user.id), bot.loop).result(timeout=5)
+                member = await guild.fetch_member(user.id)
             except Exception:
-                member = None
-        if member:
-            for role in member.roles:
-                if role.name == ADMIN_ROLE_NAME:
-                    return True
+                logging.exception(f"Failed to fetch member {user.id} in guild {guild.id} for authorization")
+                return False
+        return self._store(guild.id, user.id, self.member_is_admin(member))
+
+    def update_member(self, member: discord.Member):
+        # Only refresh members that have a cached decision; the rest are looked up when they run a command
+        if member.id in self._cache.get(member.guild.id, {}):
+            self._store(member.guild.id, member.id, self.member_is_admin(member))
+
+    def forget_member(self, guild_id, user_id):
+        self._cache.get(guild_id, {}).pop(user_id, None)
+
+    def forget_guild(self, guild_id):
+        self._cache.pop(guild_id, None)
+
+
+authorization = AuthorizationService()
+
+
+async def user_is_authorized(user: discord.abc.User, guild: discord.Guild | None) -> bool:
+    """Return True if the user is whitelisted or has the admin role in the guild."""
+    try:
+        return await authorization.is_authorized(user, guild)
     except Exception:
-        pass
-    return False
+        logging.exception("Authorization check failed")
+        return False
+
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    authorization.update_member(after)
+
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    authorization.forget_member(member.guild.id, member.id)
+
+
+@bot.event
+async def on_guild_role_create(role: discord.Role):
+    authorization.forget_guild(role.guild.id)
+
+
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    # A rename can grant or revoke ADMIN_ROLE_NAME for everyone holding the role
+    authorization.forget_guild(after.guild.id)
+
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    authorization.forget_guild(role.guild.id)
 
 
 @bot.event
@@ -481,6 +1005,7 @@ async def on_ready():
             if not is_cookie_full_shape(cookie_obj):
                 try:
                     os.remove('cookies.json')
+                    cookies_cache.invalidate()
                 except Exception:
                     logging.exception("Failed to remove malformed cookies.json")
                 COOKIES_MISSING = True
@@ -537,7 +1062,7 @@ async def slash_get_courses(interaction: discord.Interaction):
         logging.info(f"/get_courses requested by {interaction.user} (id={interaction.user.id}) in guild={guild_id}")
     except Exception:
         pass
-    if not user_is_authorized(interaction.user, interaction.guild):
+    if not await user_is_authorized(interaction.user, interaction.guild):
         try:
             await interaction.response.send_message("You are not authorized to use this command.", ephemeral=True)
         except discord.NotFound:
@@ -575,7 +1100,7 @@ async def slash_add_course(interaction: discord.Interaction, url: str):
         logging.info(f"/add_course requested by {interaction.user} (id={interaction.user.id}) in guild={guild_id} url={url}")
     except Exception:
         pass
-    if not user_is_authorized(interaction.user, interaction.guild):
+    if not await user_is_authorized(interaction.user, interaction.guild):
         try:
             await interaction.response.send_message("You are not authorized to use this command.", ephemeral=True)
         except discord.NotFound:
@@ -604,7 +1129,7 @@ async def slash_remove_course(interaction: discord.Interaction, url: str):
         logging.info(f"/remove_course requested by {interaction.user} (id={interaction.user.id}) in guild={guild_id} url={url}")
     except Exception:
         pass
-    if not user_is_authorized(interaction.user, interaction.guild):
+    if not await user_is_authorized(interaction.user, interaction.guild):
         try:
             await interaction.response.send_message("You are not authorized to use this command.", ephemeral=True)
         except discord.NotFound:
@@ -666,7 +1191,7 @@ async def get_cookie(interaction: discord.Interaction):
         logging.info(f"/get_cookie requested by {interaction.user} (id={interaction.user.id}) in guild={guild_id}")
     except Exception:
         pass
-    if not user_is_authorized(interaction.user, interaction.guild):
+    if not await user_is_authorized(interaction.user, interaction.guild):
         try:
             await interaction.response.send_message("You are not authorized to use this command.", ephemeral=True)
         except discord.NotFound:
@@ -727,7 +1252,7 @@ async def set_cookie(interaction: discord.Interaction, cookie_value: str):
         logging.info(f"/set_cookie requested by {interaction.user} (id={interaction.user.id}) in guild={guild_id}")
     except Exception:
         pass
-    if not user_is_authorized(interaction.user, interaction.guild):
+    if not await user_is_authorized(interaction.user, interaction.guild):
         await interaction.response.send_message("You are not authorized to use this command.", ephemeral=True)
         return
     global COOKIES_MISSING, cookies
@@ -772,35 +1297,146 @@ async def set_cookie(interaction: discord.Interaction, cookie_value: str):
                 logging.exception("Also failed to DM user after set_cookie failure")
 
 
-def start_discord_bot():
-    if not DISCORD_BOT_TOKEN:
-        logging.info("DISCORD_BOT_TOKEN not set; Discord admin bot will not start.")
-        return
-    def _run():
+async def run_discord_bot():
+    """Run the bot on the current loop until it is closed or the task is cancelled."""
+    try:
+        # bot.start() leaves logging alone, so discord.py logs go through our queue pipeline
+        async with bot:
+            await bot.start(DISCORD_BOT_TOKEN)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logging.exception(f"Discord bot stopped: {e}")
+
+
+# Built-in rule table, in priority order: the first rule that matches anywhere wins
+DEFAULT_CLASSIFIER_RULES = [
+    {"category": "post_lecture", "pattern": r"\bpost[- ]?lecture\b"},
+    {"category": "pre_lecture", "pattern": r"\bpre[- ]?lecture\b"},
+    {"category": "lecture", "pattern": r"\blecture\b"},
+    {"category": "tutorial", "pattern": r"\btutorial\b"},
+]
+
+
+class ActivityClassifier:
+    """Rule table compiled into one case-insensitive alternation regex.
+
+    rules is a list of {"category", "pattern"} dicts in priority order; the
+    result for an activity is the category of the highest-priority rule that
+    matches anywhere in "title desc", or "others". One search over the text
+    finds the leftmost match (at any position the alternation tries rules in
+    priority order). Only when that match is not the top rule is the rest of
+    the text searched again, with an alternation of just the rules that
+    outrank it. A leading \b shared by every pattern is hoisted out of the
+    alternation so positions inside words are rejected once; that is only done
+    when no pattern has a top-level "|", which the hoisting would change.
+    Each rule becomes a named group, so patterns may not refer to groups by
+    number (\1, (?(1)...)).
+    """
+    FALLBACK = "others"
+    RESERVED = ("notices",)
+
+    def __init__(self, rules):
+        self.rules = []
+        for rule in rules:
+            if not isinstance(rule, dict) or not isinstance(rule.get("category"), str) or not rule["category"]:
+                raise ValueError(f"classifier rule needs a non-empty \"category\": {rule!r}")
+            if rule["category"] in self.RESERVED:
+                raise ValueError(f"classifier category {rule['category']!r} is reserved")
+            try:
+                re.compile(rule["pattern"])
+            except (KeyError, TypeError, re.error) as e:
+                raise ValueError(f"bad pattern for classifier category {rule['category']!r}: {e!r}")
+            if self._scan(rule["pattern"])[1]:
+                raise ValueError(f"pattern for classifier category {rule['category']!r} refers to a group by number; "
+                                 f"use a named group and (?P=name) instead")
+            self.rules.append((rule["category"], rule["pattern"]))
+        self.categories = list(dict.fromkeys(category for category, _ in self.rules))
+        # _alternations[n] matches rules[:n]; the last one is the full table
         try:
-            bot.run(DISCORD_BOT_TOKEN)
-        except Exception as e:
-            logging.exception(f"Discord bot stopped: {e}")
-    thread = threading.Thread(target=_run, name="discord-bot-thread", daemon=True)
-    thread.start()
+            self._alternations = [None] + [self._compile(self.rules[:n]) for n in range(1, len(self.rules) + 1)]
+        except re.error as e:
+            raise ValueError(f"classifier rules do not combine into one pattern: {e}")
+
+    @staticmethod
+    def _scan(pattern):
+        """(has a top-level "|", refers to a group by number) for a regex pattern."""
+        depth = 0
+        in_class = False
+        alternation = numbered = False
+        i = 0
+        while i < len(pattern):
+            char = pattern[i]
+            if char == "\\":
+                # \1-\99 are backreferences; three octal digits (\101) are a character
+                digits = re.match(r"[1-9][0-9]?[0-9]?", pattern[i + 1:])
+                if not in_class and digits and not (len(digits[0]) == 3 and re.fullmatch("[0-7]+", digits[0])):
+                    numbered = True
+                i += 2
+                continue
+            if in_class:
+                in_class = char != "]"
+            elif char == "[":
+                in_class = True
+                # A "]" right after "[" or "[^" is a literal
+                i += 1 if pattern.startswith("^", i + 1) else 0
+                i += 1 if pattern.startswith("]", i + 1) else 0
+            elif char == "(":
+                numbered = numbered or bool(re.match(r"\(\?\(\d", pattern[i:]))
+                depth += 1
+            elif char == ")":
+                depth -= 1
+            elif char == "|" and depth == 0:
+                alternation = True
+            i += 1
+        return alternation, numbered
+
+    @staticmethod
+    def _compile(rules):
+        if all(pattern.startswith(r"\b") and not ActivityClassifier._scan(pattern[2:])[0] for _, pattern in rules):
+            branches = "|".join(f"(?P<_r{i}>{pattern[2:]})" for i, (_, pattern) in enumerate(rules))
+            return re.compile(rf"\b(?:{branches})", re.IGNORECASE)
+        return re.compile("|".join(f"(?P<_r{i}>{pattern})" for i, (_, pattern) in enumerate(rules)), re.IGNORECASE)
+
+    def classify(self, title, desc=""):
+        if not self.rules:
+            return self.FALLBACK
+        text = f"{title} {desc}"
+        match = self._alternations[-1].search(text)
+        if match is None:
+            return self.FALLBACK
+        best = int(match.lastgroup[2:])
+        while best:
+            match = self._alternations[best].search(text, match.start() + 1)
+            if match is None:
+                break
+            best = int(match.lastgroup[2:])
+        return self.rules[best][0]
+
+
+def _classifier_from_json(data):
+    return ActivityClassifier(data if data is not None else DEFAULT_CLASSIFIER_RULES)
+
+
+# Compiled once and rebuilt only when the rules file changes; a bad file keeps the previous rules
+classifier_rules = CachedJsonFile(CLASSIFIER_RULES_PATH, _classifier_from_json, None)
+
 
 def classify(title, desc):
-    text = f"{title} {desc}".lower()
-    if re.search(r'\bpost[- ]?lecture\b', text):
-        return "post_lecture"
-    elif re.search(r'\bpre[- ]?lecture\b', text):
-        return "pre_lecture"
-    elif re.search(r'\blecture\b', text):
-        return "lecture"
-    elif re.search(r'\btutorial\b', text):
-        return "tutorial"
-    return "others"
+    return classifier_rules.get().classify(title, desc)
+
+
+def empty_categories(classifier):
+    """{category: []} for every classifier category, then "others" and "notices", in course_data order."""
+    categorized = {category: [] for category in classifier.categories}
+    categorized.setdefault(ActivityClassifier.FALLBACK, [])
+    categorized["notices"] = []
+    return categorized
+
 
 def parse_activities(activity_elements, enable_classification=True):
-    categorized = {
-        "pre_lecture": [], "lecture": [], "post_lecture": [],
-        "tutorial": [], "others": [], "notices": []
-    }
+    classifier = classifier_rules.get()
+    categorized = empty_categories(classifier)
 
     for act in activity_elements:
         instancename = act.select_one(".instancename")
@@ -813,7 +1449,7 @@ def parse_activities(activity_elements, enable_classification=True):
                 span.decompose()
             title = instancename.get_text(strip=True)
             url = link["href"]
-            category = classify(title, desc_text) if enable_classification else "others"
+            category = classifier.classify(title, desc_text) if enable_classification else ActivityClassifier.FALLBACK
             categorized[category].append({"title": title, "url": url})
         else:
             notice_div = act.select_one(".description-inner")
@@ -825,62 +1461,799 @@ def parse_activities(activity_elements, enable_classification=True):
 
     return {k: v for k, v in categorized.items() if v}
 
+
+def fast_digest(payload: bytes) -> str:
+    """Non-cryptographic content digest used for change detection."""
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(payload)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def hash_item(item):
+    if "url" in item and "title" in item and len(item) == 2:
+        payload = f"r\0{item['title']}\0{item['url']}"
+    elif "notice" in item and len(item) == 1:
+        payload = f"n\0{item['notice']}"
+    else:
+        payload = json.dumps(item, sort_keys=True)
+    return fast_digest(payload.encode("utf-8"))
+
+
+class SectionHashes:
+    """One section of a hash tree: the section's hash and {category: hash}."""
+    __slots__ = ("hash", "categories")
+
+    def __init__(self, hash, categories):
+        self.hash = hash
+        self.categories = categories
+
+    def __eq__(self, other):
+        return isinstance(other, SectionHashes) and (self.hash, self.categories) == (other.hash, other.categories)
+
+
+def hash_tree(data):
+    """Hierarchical hashes for course_data: course -> section -> category -> item.
+
+    Returns (root_hash, sections) where sections maps each section title to a
+    SectionHashes record. Item order inside a category matters,
+    section/category order does not.
+    """
+    sections = {}
+    for section, entries in data.items():
+        categories = {category: fast_digest("".join(hash_item(i) for i in items).encode())
+                      for category, items in entries.items()}
+        section_hash = fast_digest("".join(f"{c}\0{h}\0" for c, h in sorted(categories.items())).encode("utf-8"))
+        sections[section] = SectionHashes(section_hash, categories)
+    root = fast_digest("".join(f"{s}\0{v.hash}\0" for s, v in sorted(sections.items())).encode("utf-8"))
+    return root, sections
+
+
+def intern_tree(sections):
+    """Copy of a hash tree whose section and category names are interned.
+
+    Courses share most of these names ("Week 3", "lecture", "notices"), so a
+    tree kept in previous_data then costs little more than its digests.
+    """
+    return {
+        sys.intern(section): SectionHashes(hashes.hash, {sys.intern(c): h for c, h in hashes.categories.items()})
+        for section, hashes in sections.items()
+    }
+
+
+def tree_from_json(sections):
+    """Hash tree from its stored form, {section: {"hash": ..., "categories": {...}}}."""
+    return intern_tree({section: SectionHashes(v["hash"], v["categories"]) for section, v in sections.items()})
+
+
+def _state_json(obj):
+    """json.dumps default for course state: hash tree records are stored as {"hash", "categories"} dicts."""
+    if isinstance(obj, SectionHashes):
+        return {"hash": obj.hash, "categories": obj.categories}
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
 def hash_data(data):
-    return hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    return hash_tree(data)[0]
+
+
+def changed_scope(old_sections, new_sections):
+    """Return the (section, category) pairs whose hashes differ between two hash trees.
+
+    Unchanged sections are skipped without looking at their categories.
+    """
+    scope = set()
+    for section in old_sections.keys() | new_sections.keys():
+        old = old_sections.get(section)
+        new = new_sections.get(section)
+        if old and new and old.hash == new.hash:
+            continue
+        old_categories = old.categories if old else {}
+        new_categories = new.categories if new else {}
+        for category in old_categories.keys() | new_categories.keys():
+            if old_categories.get(category) != new_categories.get(category):
+                scope.add((section, category))
+    return scope
+
+
+def item_identity(item):
+    """Stable identity of a parsed item: its URL, or a digest of the notice text."""
+    if "url" in item:
+        return "url:" + item["url"]
+    notice = item.get("notice", json.dumps(item, sort_keys=True))
+    return "notice:" + hashlib.blake2b(notice.encode("utf-8"), digest_size=12).hexdigest()
 
-def send_discord_notification(course_title, section, item):
-    # Convert the item to a discord.Embed and send via the bot to the configured channel
+
+def index_course_data(data, scope=None):
+    """Map identity -> (section, category, item) for every item in course_data.
+
+    Repeated identities (the same link posted twice) get an occurrence suffix
+    so each copy is still tracked on its own. With scope, only the given
+    (section, category) pairs are indexed.
+    """
+    index = {}
+    for section, entries in data.items():
+        for category, items in entries.items():
+            if scope is not None and (section, category) not in scope:
+                continue
+            for item in items:
+                key = item_identity(item)
+                if key in index:
+                    n = 2
+                    while f"{key}#{n}" in index:
+                        n += 1
+                    key = f"{key}#{n}"
+                index[key] = (section, category, item)
+    return index
+
+
+def diff_course_data(old_data, new_data, scope=None):
+    """Compare two course_data dicts in linear time.
+
+    Returns a change set {"added", "removed", "modified", "moved"}, each a
+    list of {"section", "category", "item"} dicts. Moved entries also carry
+    "old_section"/"old_category"; modified and moved entries carry "old_item"
+    when the item itself changed (e.g. a renamed resource). scope, usually from
+    changed_scope(), limits the walk to the categories whose hashes differ.
+    """
+    old_index = index_course_data(old_data, scope)
+    changes = {"added": [], "removed": [], "modified": [], "moved": []}
+    for key, (section, category, item) in index_course_data(new_data, scope).items():
+        old = old_index.pop(key, None)
+        entry = {"section": section, "category": category, "item": item}
+        if old is None:
+            changes["added"].append(entry)
+            continue
+        old_section, old_category, old_item = old
+        if old_item != item:
+            entry["old_item"] = old_item
+        if (old_section, old_category) != (section, category):
+            entry["old_section"] = old_section
+            entry["old_category"] = old_category
+            changes["moved"].append(entry)
+        elif old_item != item:
+            changes["modified"].append(entry)
+    for section, category, item in old_index.values():
+        changes["removed"].append({"section": section, "category": category, "item": item})
+    return changes
+
+
+def describe_changes(changes):
+    """Short human-readable summary of a change set for the logs."""
+    return ", ".join(f"{len(v)} {k}" for k, v in changes.items() if v) or "no item changes"
+
+
+# change kind -> (message content, embed color)
+CHANGE_STYLES = {
+    "added": ("@here 📢 New course update", 0x5865F2),
+    "modified": ("📝 Course item updated", 0xFAA61A),
+    "removed": ("🗑️ Course item removed", 0xED4245),
+    "moved": ("↪️ Course item moved", 0x99AAB5),
+}
+
+
+def build_notification_embed(course_title, section, item, change="added"):
     is_resource = isinstance(item, dict) and "url" in item
     is_notice = isinstance(item, dict) and "notice" in item
+    color = CHANGE_STYLES.get(change, CHANGE_STYLES["added"])[1]
 
     title_text = item.get("title") if is_resource else ("New Notice" if is_notice else "Update")
+    if is_notice and change != "added":
+        title_text = f"Notice {change}"
     url = item.get("url") if is_resource else None
     description = item.get("notice") if is_notice else (f"[Open resource]({url})" if url else "")
 
-    embed = discord.Embed(title=title_text, description=description, color=0x5865F2, timestamp=datetime.now(timezone.utc))
+    embed = discord.Embed(title=title_text[:256], description=description[:4000], color=color, timestamp=datetime.now(timezone.utc))
     if url:
         embed.url = url
     embed.add_field(name="Course", value=course_title, inline=True)
     embed.add_field(name="Section", value=section, inline=True)
     embed.add_field(name="Type", value=("Notice" if is_notice else ("Resource" if is_resource else "Other")), inline=True)
+    if change != "added":
+        embed.add_field(name="Change", value=change.capitalize(), inline=True)
     embed.set_footer(text="lms-scraper")
+    return embed
+
+
+class NotificationOutbox:
+    """Disk-backed queue of pending notifications (SQLite table "outbox").
+
+    Change events are appended here before the course state that contains
+    them is committed, and rows are only deleted once Discord accepted the
+    message, so a crash, restart or a bot that is not ready yet delays
+    notifications instead of losing them (delivery is at-least-once). Rows
+    that fail OUTBOX_MAX_ATTEMPTS times, or that Discord rejects outright,
+    are kept with status "dead".
+    created_at is when the page that produced the change was fetched, so the
+    dispatcher's latency covers the whole fetch -> notification path.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at REAL NOT NULL,
+            course_title TEXT NOT NULL,
+            section TEXT NOT NULL,
+            change TEXT NOT NULL,
+            item TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            last_error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, id);
+    """
+
+    def __init__(self, path=OUTBOX_DB_PATH, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # Used from asyncio.to_thread() workers, so calls may come from different threads
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def append(self, entries, created_at=None):
+        """Durably store (course_title, section, item, change) tuples in one transaction."""
+        now = time.time() if created_at is None else created_at
+        rows = [(now, course_title, section, change, json.dumps(item, ensure_ascii=False))
+                for course_title, section, item, change in entries]
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO outbox (created_at, course_title, section, change, item) VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    def fetch(self, limit):
+        """Return up to limit pending rows as (id, created_at, course_title, section, item, change)."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, created_at, course_title, section, item, change FROM outbox "
+                "WHERE status = 'pending' ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+        return [(row_id, created_at, course_title, section, json.loads(item), change)
+                for row_id, created_at, course_title, section, item, change in rows]
+
+    def ack(self, ids):
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+    def fail(self, ids, error, permanent=False):
+        """Count a failed send; rows that are out of attempts (or permanent failures) become dead."""
+        max_attempts = 1 if permanent else self.max_attempts
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ?, "
+                "status = CASE WHEN attempts + 1 >= ? THEN 'dead' ELSE 'pending' END WHERE id = ?",
+                [(error[:500], max_attempts, i) for i in ids],
+            )
+
+    def depth(self):
+        """Return (pending, dead) row counts."""
+        with self._lock:
+            counts = dict(self.conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        return counts.get("pending", 0), counts.get("dead", 0)
+
+
+class NotificationDispatcher:
+    """Drains the notification outbox on the event loop, batched and paced for Discord.
+
+    Scraper tasks await enqueue(), which writes to the durable outbox and
+    wakes the sender. When the outbox holds more than NOTIFY_QUEUE_SIZE pending
+    rows while the bot is connected, enqueue() waits until the sender has
+    brought it back under that bound, or has a batch fail (back-pressure
+    cannot help while Discord rejects sends). The sender waits NOTIFY_BATCH_DELAY after a wake-up so a
+    burst can accumulate, groups pending rows by course and section, and sends
+    each group as messages of up to 10 embeds (and 6000 embed characters).
+    Rows are deleted only after their message was sent. Sends are paced to
+    NOTIFY_MESSAGES_PER_5S per channel; a 429 that still gets through is
+    retried after Discord's retry_after.
+    """
+    MAX_EMBEDS = 10
+    MAX_EMBED_CHARS = 6000
+
+    def __init__(self, bot, max_queue=NOTIFY_QUEUE_SIZE, batch_delay=NOTIFY_BATCH_DELAY,
+                 messages_per_5s=NOTIFY_MESSAGES_PER_5S):
+        self.bot = bot
+        self.max_queue = max_queue
+        self.batch_delay = batch_delay
+        self.messages_per_5s = messages_per_5s
+        self._outbox = None
+        self._outbox_lock = threading.Lock()
+        self._wake = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._task = None
+        self._sent_at = deque()
+        self._stats_lock = threading.Lock()
+        self.stats = {"items": 0, "messages": 0, "batches": 0, "rate_limited": 0, "failed": 0,
+                      "groups": 0, "latency_total": 0.0, "latency_max": 0.0, "send_seconds": 0.0}
+
+    @property
+    def outbox(self):
+        with self._outbox_lock:
+            if self._outbox is None:
+                self._outbox = NotificationOutbox()
+            return self._outbox
+
+    def start(self):
+        """Start the sender task on the running loop (no-op if it is already running)."""
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run(), name="notification-dispatcher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def enqueue(self, course_title, entries, fetched_at=None, timeout=60):
+        """Durably queue [(section, item, change), ...] for one course.
+
+        fetched_at (epoch seconds) is when the course page was fetched and is
+        the start of the latency reported by pop_stats(). Raises if the outbox
+        cannot be written, so the caller does not commit state whose
+        notifications would be lost.
+        """
+        rows = [(course_title, section, item, change) for section, item, change in entries]
+        await asyncio.to_thread(self.outbox.append, rows, fetched_at)
+        self._wake.set()
+        if self.bot.is_ready() and (await asyncio.to_thread(self.outbox.depth))[0] > self.max_queue:
+            self._drained.clear()
+            try:
+                await asyncio.wait_for(self._drained.wait(), timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Notification outbox still above {self.max_queue} pending rows after {timeout}s")
+
+    async def submit(self, course_title, section, item, change="added"):
+        """Queue a single notification."""
+        await self.enqueue(course_title, [(section, item, change)])
+
+    def _bump(self, **values):
+        with self._stats_lock:
+            for key, value in values.items():
+                if key == "latency_max":
+                    self.stats[key] = max(self.stats[key], value)
+                else:
+                    self.stats[key] += value
+
+    def pop_stats(self):
+        """Return counters since the last call (plus outbox depth) and reset them."""
+        with self._stats_lock:
+            snapshot = dict(self.stats)
+            for key in self.stats:
+                self.stats[key] = 0
+        snapshot["queue_depth"], snapshot["dead"] = self.outbox.depth()
+        return snapshot
+
+    async def _channel(self):
+        channel_id = int(DISCORD_NOTIFY_CHANNEL_ID)
+        return self.bot.get_channel(channel_id) or await self.bot.fetch_channel(channel_id)
+
+    async def _pace(self):
+        # Stay under Discord's per-channel message bucket instead of bouncing off 429s
+        now = time.monotonic()
+        while self._sent_at and now - self._sent_at[0] >= 5:
+            self._sent_at.popleft()
+        if len(self._sent_at) >= self.messages_per_5s:
+            await asyncio.sleep(5 - (now - self._sent_at[0]))
+            self._sent_at.popleft()
+        self._sent_at.append(time.monotonic())
+
+    async def _send(self, channel, content, embeds):
+        for attempt in range(3):
+            await self._pace()
+            try:
+                with STAGE_SECONDS.time("notify_send"):
+                    await channel.send(content=content, embeds=embeds)
+                return
+            except discord.HTTPException as e:
+                if e.status != 429 or attempt == 2:
+                    raise
+                self._bump(rate_limited=1)
+                retry_after = getattr(e, "retry_after", None) or 5
+                logging.warning(f"Discord rate limited notification send; retrying in {retry_after:.1f}s")
+                await asyncio.sleep(retry_after)
+
+    @classmethod
+    def _chunk(cls, rows):
+        chunk, chars = [], 0
+        for row in rows:
+            size = len(row[1])
+            if chunk and (len(chunk) >= cls.MAX_EMBEDS or chars + size > cls.MAX_EMBED_CHARS):
+                yield chunk
+                chunk, chars = [], 0
+            chunk.append(row)
+            chars += size
+        if chunk:
+            yield chunk
+
+    async def _run(self):
+        while True:
+            try:
+                if not self.bot.is_ready():
+                    await asyncio.sleep(5)
+                    continue
+                rows = await asyncio.to_thread(self.outbox.fetch, 500)
+                if not rows:
+                    self._drained.set()
+                    self._wake.clear()
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), timeout=30)
+                    except asyncio.TimeoutError:
+                        continue
+                    # Let the rest of a burst land in the outbox before sending
+                    await asyncio.sleep(self.batch_delay)
+                    continue
+                ok = await self._send_batch(rows)
+                if not ok or (await asyncio.to_thread(self.outbox.depth))[0] <= self.max_queue:
+                    self._drained.set()
+                if not ok:
+                    # Failed rows stay pending; give Discord a moment before retrying them
+                    await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                break
+            except Exception:
+                logging.exception("Unexpected error in notification dispatcher")
+                await asyncio.sleep(5)
 
+    async def _send_batch(self, rows):
+        """Send pending rows; returns False if anything has to be retried."""
+        if not DISCORD_NOTIFY_CHANNEL_ID:
+            logging.warning("DISCORD_NOTIFY_CHANNEL_ID not set; leaving notifications in the outbox")
+            await asyncio.sleep(60)
+            return False
+        try:
+            channel = await self._channel()
+        except Exception as exc:
+            logging.exception(f"Failed to fetch notify channel {DISCORD_NOTIFY_CHANNEL_ID}: {exc}")
+            await asyncio.sleep(30)
+            return False
+
+        groups = {}
+        created_by_id = {row[0]: row[1] for row in rows}
+        for row_id, created_at, course_title, section, item, change in rows:
+            groups.setdefault((course_title, section), []).append((row_id, created_at, item, change))
+
+        started = time.monotonic()
+        ok = True
+        for (course_title, section), entries in groups.items():
+            kinds = [change for _, _, _, change in entries]
+            # Ping (@here) only when something new was added
+            content = CHANGE_STYLES["added"][0] if "added" in kinds else CHANGE_STYLES.get(kinds[0], CHANGE_STYLES["added"])[0]
+            if len(entries) > 1:
+                content += f" ({len(entries)} items in {course_title} / {section})"
+            embedded = [(row_id, build_notification_embed(course_title, section, item, change))
+                        for row_id, _, item, change in entries]
+            for chunk in self._chunk(embedded):
+                ids = [row_id for row_id, _ in chunk]
+                try:
+                    await self._send(channel, content, [embed for _, embed in chunk])
+                except Exception as e:
+                    logging.exception("Failed to send embed notification via bot")
+                    # A 4xx other than 429 (missing access, invalid embed) fails the same way on every retry
+                    permanent = isinstance(e, discord.HTTPException) and 400 <= e.status < 500 and e.status != 429
+                    await asyncio.to_thread(self.outbox.fail, ids, repr(e), permanent)
+                    self._bump(failed=len(chunk))
+                    NOTIFICATIONS_TOTAL.inc("failed", amount=len(chunk))
+                    ok = False
+                    continue
+                await asyncio.to_thread(self.outbox.ack, ids)
+                self._bump(messages=1, items=len(chunk))
+                NOTIFICATIONS_TOTAL.inc("sent", amount=len(chunk))
+                for row_id, _ in chunk:
+                    NOTIFY_LATENCY_SECONDS.observe(time.time() - created_by_id[row_id])
+            latency = time.time() - min(created_at for _, created_at, _, _ in entries)
+            self._bump(groups=1, latency_total=latency, latency_max=latency)
+        self._bump(batches=1, send_seconds=time.monotonic() - started)
+        return ok
+
+
+notification_dispatcher = NotificationDispatcher(bot)
+metrics.register(Gauge("lms_scraper_outbox_pending", "Notifications waiting in the outbox.",
+                       function=lambda: notification_dispatcher.outbox.depth()[0]))
+metrics.register(Gauge("lms_scraper_outbox_dead", "Notifications that exhausted their retries.",
+                       function=lambda: notification_dispatcher.outbox.depth()[1]))
+metrics.register(Gauge("lms_scraper_discord_log_buffer", "Log records waiting to be forwarded to Discord.",
+                       function=lambda: len(DISCORD_LOG_HANDLER.buffer) if DISCORD_LOG_HANDLER is not None else 0))
+
+
+async def send_discord_notification(course_title, section, item, change="added"):
+    """Queue a change notification; NotificationDispatcher batches and sends it."""
     if not DISCORD_NOTIFY_CHANNEL_ID:
         logging.warning("DISCORD_NOTIFY_CHANNEL_ID not set; skipping bot-based notification")
         return
 
     try:
-        channel_id = int(DISCORD_NOTIFY_CHANNEL_ID)
+        int(DISCORD_NOTIFY_CHANNEL_ID)
     except Exception:
         logging.error("DISCORD_NOTIFY_CHANNEL_ID is not a valid integer channel id")
         return
 
-    if not bot.is_ready():
-        logging.warning("Discord bot not ready yet; cannot send notification")
-        return
+    await notification_dispatcher.submit(course_title, section, item, change)
 
-    async def _send():
-        channel = bot.get_channel(channel_id)
-        if channel is None:
+
+class FetchedPage:
+    """A fully downloaded LMS response (the parts the scraper looks at)."""
+    __slots__ = ("url", "status_code", "headers", "content", "encoding")
+
+    def __init__(self, url, status_code, headers, content, encoding):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+
+class MoodleHttpClient:
+    """Shared keep-alive aiohttp client for LMS requests.
+
+    One ClientSession carries the MoodleSession cookie and the default headers.
+    Its connector caps open connections at SCRAPE_CONCURRENCY overall and
+    SCRAPE_PER_HOST_LIMIT per LMS host, every call gets connect/read timeouts,
+    and 5xx responses and connection errors are retried with exponential
+    backoff and full jitter. The session is created on first use and belongs
+    to the loop that created it.
+    """
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, pool_size=SCRAPE_CONCURRENCY, per_host_limit=SCRAPE_PER_HOST_LIMIT,
+                 connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT, max_retries=HTTP_MAX_RETRIES,
+                 backoff_base=HTTP_BACKOFF_BASE, backoff_max=HTTP_BACKOFF_MAX, verify=LMS_VERIFY_TLS):
+        self.pool_size = pool_size
+        self.per_host_limit = per_host_limit
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.verify = verify
+        self.session = None
+        self._cookie_value = None
+        self._cookie_header = {}
+        self.stats = {"requests": 0, "new_connections": 0, "retries": 0, "timeouts": 0, "failures": 0}
+
+    async def start(self):
+        if self.session is not None and not self.session.closed:
+            return
+        trace = aiohttp.TraceConfig()
+        trace.on_dns_resolvehost_start.append(self._trace_mark("dns_started"))
+        trace.on_dns_resolvehost_end.append(self._trace_stage("dns_started", "dns"))
+        trace.on_connection_create_start.append(self._trace_mark("connect_started"))
+        trace.on_connection_create_end.append(self._trace_stage("connect_started", "connect"))
+        trace.on_connection_create_end.append(self._count_new_connection)
+        trace.on_request_headers_sent.append(self._trace_mark("headers_sent"))
+        trace.on_request_end.append(self._trace_stage("headers_sent", "ttfb"))
+        connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.per_host_limit, ssl=self.verify)
+        # The MoodleSession cookie is sent explicitly; cookies set by the LMS are not kept
+        self.session = aiohttp.ClientSession(
+            headers=headers, connector=connector, timeout=self.timeout,
+            cookie_jar=aiohttp.DummyCookieJar(), trace_configs=[trace],
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _count_new_connection(self, session, context, params):
+        self.stats["new_connections"] += 1
+
+    @staticmethod
+    def _trace_mark(attr):
+        async def mark(session, context, params):
+            setattr(context, attr, time.perf_counter())
+        return mark
+
+    @staticmethod
+    def _trace_stage(attr, stage):
+        # Response headers arriving after the request was sent is the time to first byte
+        async def observe(session, context, params):
+            started = getattr(context, attr, None)
+            if started is not None:
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage)
+        return observe
+
+    def set_cookies(self, req_cookies):
+        """Update the MoodleSession cookie if it changed since the last call."""
+        value = (req_cookies or {}).get("MoodleSession")
+        if value == self._cookie_value:
+            return
+        self._cookie_value = value
+        self._cookie_header = {"Cookie": f"MoodleSession={value}"} if value else {}
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _request(self, url, req_headers, read_body, data=None):
+        """GET url (POST data, if given) with retries; returns a FetchedPage, or the open response if not read_body."""
+        await self.start()
+        req_headers = {**self._cookie_header, **(req_headers or {})}
+        attempt = 0
+        while True:
+            self.stats["requests"] += 1
             try:
-                channel = await bot.fetch_channel(channel_id)
-            except Exception as exc:
-                logging.exception(f"Failed to fetch notify channel {channel_id}: {exc}")
-                return
+                if data is None:
+                    response = await self.session.get(url, headers=req_headers)
+                else:
+                    response = await self.session.post(url, headers=req_headers, data=data)
+                if response.status not in self.RETRY_STATUSES or attempt >= self.max_retries:
+                    if not read_body:
+                        return response
+                    async with response:
+                        with STAGE_SECONDS.time("download"):
+                            body = await response.read()
+                    return FetchedPage(str(response.url), response.status, response.headers, body,
+                                       response.charset or "utf-8")
+                reason = f"HTTP {response.status}"
+                response.release()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.stats["timeouts"] += 1
+                if attempt >= self.max_retries:
+                    self.stats["failures"] += 1
+                    raise
+                reason = type(e).__name__
+            delay = self._backoff(attempt)
+            attempt += 1
+            self.stats["retries"] += 1
+            logging.warning(f"Retrying {url} in {delay:.1f}s after {reason} (attempt {attempt}/{self.max_retries})")
+            await asyncio.sleep(delay)
+
+    async def get(self, url, headers=None):
+        """Download url completely and return a FetchedPage."""
+        return await self._request(url, headers, read_body=True)
+
+    async def post(self, url, data, headers=None):
+        """POST form data to url and return the complete response as a FetchedPage.
+
+        Only for idempotent calls (Moodle web service reads): failures are retried like GETs.
+        """
+        return await self._request(url, headers, read_body=True, data=data)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, url, headers=None):
+        """Yield the aiohttp response with its body still unread, for chunked reading."""
+        response = await self._request(url, headers, read_body=False)
         try:
-            await channel.send(content="@here 📢 New course update", embed=embed)
-        except Exception:
-            logging.exception("Failed to send embed notification via bot")
+            yield response
+        finally:
+            response.release()
+
+    def pop_stats(self):
+        """Return the counters gathered since the last call and reset them."""
+        snapshot = dict(self.stats)
+        for key in self.stats:
+            self.stats[key] = 0
+        return snapshot
+
+
+http_client = MoodleHttpClient()
+
+
+def conditional_headers(validators):
+    """Build If-None-Match / If-Modified-Since headers from stored validators."""
+    req_headers = {}
+    if validators.get("etag"):
+        req_headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        req_headers["If-Modified-Since"] = validators["last_modified"]
+    return req_headers
+
+
+def response_validators(response):
+    """Validators stored next to a course's hash so the next poll can skip unchanged pages."""
+    body = response.content
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "content_length": len(body),
+        "digest": hashlib.blake2b(body, digest_size=16).hexdigest(),
+    }
 
-    try:
-        asyncio.run_coroutine_threadsafe(_send(), bot.loop)
-    except Exception:
-        logging.exception("Failed to schedule embed send on bot loop")
 
-def scrape_course(url):
-    req_cookies = read_cookies()
-    response = requests.get(url, cookies=req_cookies, headers=headers, verify=False)
-    soup = BeautifulSoup(response.text, "html.parser")
+def lms_url(url):
+    """Return the URL to fetch for a course URL (its host replaced by LMS_BASE_URL, if set)."""
+    if not LMS_BASE_URL:
+        return url
+    parts = urllib.parse.urlsplit(url)
+    return LMS_BASE_URL + urllib.parse.urlunsplit(("", "", parts.path, parts.query, ""))
+
+
+def check_not_login_page(final_url):
+    """Raise if a course request ended on the Moodle login page.
+
+    Moodle redirects to /login/index.php when the session is missing or has
+    expired; parsing that page would report every item of the course as removed.
+    """
+    if "/login/" in urllib.parse.urlsplit(final_url).path:
+        raise RuntimeError("redirected to the Moodle login page; the MoodleSession cookie is missing or expired")
+
+
+def check_course_status(status):
+    """Raise unless a course request got a 2xx page or a 304.
+
+    Error pages (a 404, or a 503 left after the retries) still have an h1, so
+    parsing one would report every item of the course as removed.
+    """
+    if status != 304 and not 200 <= status < 300:
+        raise RuntimeError(f"course page returned HTTP {status}")
+
+
+async def fetch_course_page(url, validators=None):
+    """Download a course page and return it as a FetchedPage.
+
+    When validators from a previous fetch are given the request is conditional,
+    so an unchanged page comes back as an empty 304 response.
+    """
+    http_client.set_cookies(read_cookies())
+    req_headers = conditional_headers(validators) if validators else {}
+    page = await http_client.get(lms_url(url), headers=req_headers)
+    check_not_login_page(page.url)
+    check_course_status(page.status_code)
+    return page
+
+
+class CourseContentStrainer(SoupStrainer):
+    """parse_only filter that builds just the parts of a page parse_course_page reads.
+
+    Keeps every h1, the general activities list and each li.section.main with
+    its whole subtree; navigation, drawers and footer are never turned into
+    Tag objects.
+    """
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        if name == "h1":
+            return True
+        classes = (attrs or {}).get("class") or ""
+        if not isinstance(classes, str):
+            classes = " ".join(classes)
+        classes = classes.split()
+        if name == "ul":
+            return "general-section-activities" in classes
+        if name == "li":
+            return "section" in classes and "main" in classes
+        return False
+
+    def allow_string_creation(self, string):
+        return False
+
+
+COURSE_CONTENT_STRAINER = CourseContentStrainer()
+
+# backend name -> (BeautifulSoup tree builder, restrict parse to course content)
+PARSER_BACKENDS = {
+    "html.parser": ("html.parser", False),
+    "lxml": ("lxml", False),
+    "strainer": ("html.parser", True),
+    "lxml-strainer": ("lxml", True),
+}
+
+
+def resolve_parser_backend(name):
+    """Return a usable backend name, falling back to html.parser if name is unknown or lxml is missing."""
+    if name not in PARSER_BACKENDS:
+        logging.warning(f"Unknown PARSER_BACKEND {name!r}; using html.parser")
+        return "html.parser"
+    if PARSER_BACKENDS[name][0] == "lxml":
+        try:
+            import lxml  # noqa: F401
+        except ImportError:
+            fallback = "strainer" if PARSER_BACKENDS[name][1] else "html.parser"
+            logging.warning(f"PARSER_BACKEND {name!r} needs lxml, which is not installed; using {fallback}")
+            return fallback
+    return name
+
+
+PARSER_BACKEND = resolve_parser_backend(PARSER_BACKEND)
+
+
+def parse_course_page(html, backend=None):
+    """Extract (title, course_data) from a rendered Moodle course page.
+
+    backend selects one of PARSER_BACKENDS (defaults to PARSER_BACKEND); all of
+    them produce the same course_data.
+    """
+    builder, strained = PARSER_BACKENDS[backend or PARSER_BACKEND]
+    soup = BeautifulSoup(html, builder, parse_only=COURSE_CONTENT_STRAINER if strained else None)
     title = soup.find("h1").get_text(strip=True)
     course_data = {}
 
@@ -888,50 +2261,1377 @@ def scrape_course(url):
     if general_activities:
         course_data["General Activities"] = parse_activities(general_activities, False)
 
-    sections = soup.select("li.section.main")
+    for section in soup.select("li.section.main"):
+        parsed_section = parse_section(section)
+        if parsed_section:
+            course_data[parsed_section[0]] = parsed_section[1]
+
+    return title, course_data
+
+
+def parse_section(section):
+    """Return (section_title, categorized activities) for an li.section.main, or None if it has nothing."""
+    section_title_el = section.select_one(".sectionname")
+    if not section_title_el:
+        return None
+    section_title = section_title_el.get_text(strip=True)
+    activity_elements = section.select("li.activity")
+    is_week_section = section_title.lower().startswith("week")
+    parsed = parse_activities(activity_elements, enable_classification=is_week_section)
+    if not parsed:
+        return None
+    return section_title, parsed
+
+
+class CourseStreamParser(HTMLParser):
+    """Incremental course page parser that only ever holds one section in memory.
+
+    Text is fed in chunks as it downloads. The raw markup of the page title,
+    the general activities list and each li.section.main is captured while it
+    streams past and, as soon as the element closes, parsed on its own with
+    the same extraction code parse_course_page uses. Finished records are
+    collected in self.records as ("title", title), ("general", activities)
+    or ("section", section_title, activities).
+    """
+    VOID_ELEMENTS = frozenset((
+        "area", "base", "br", "col", "embed", "hr", "img", "input",
+        "link", "meta", "param", "source", "track", "wbr",
+    ))
+
+    def __init__(self):
+        # Keep character references raw so captured fragments match the source markup
+        super().__init__(convert_charrefs=False)
+        self.records = []
+        self._title_seen = False
+        self._kind = None
+        self._stack = []
+        self._buf = []
+
+    def _capture_kind(self, tag, attrs):
+        classes = (dict(attrs).get("class") or "").split()
+        if tag == "h1" and not self._title_seen:
+            return "title"
+        if tag == "ul" and "general-section-activities" in classes:
+            return "general"
+        if tag == "li" and "section" in classes and "main" in classes:
+            return "section"
+        return None
+
+    def handle_starttag(self, tag, attrs):
+        if self._kind is None:
+            self._kind = self._capture_kind(tag, attrs)
+            if self._kind is None:
+                return
+        self._buf.append(self.get_starttag_text())
+        if tag not in self.VOID_ELEMENTS:
+            self._stack.append(tag)
+        elif not self._stack:
+            self._finish()
+
+    def handle_startendtag(self, tag, attrs):
+        if self._kind is not None:
+            self._buf.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if self._kind is None:
+            return
+        self._buf.append(f"</{tag}>")
+        # Like bs4, an end tag closes everything opened after its matching start tag
+        if tag in self._stack:
+            while self._stack.pop() != tag:
+                pass
+        if not self._stack:
+            self._finish()
+
+    def handle_data(self, data):
+        if self._kind is not None:
+            self._buf.append(data)
+
+    def handle_entityref(self, name):
+        if self._kind is not None:
+            self._buf.append(f"&{name};")
+
+    def handle_charref(self, name):
+        if self._kind is not None:
+            self._buf.append(f"&#{name};")
+
+    def handle_comment(self, data):
+        if self._kind is not None:
+            self._buf.append(f"<!--{data}-->")
+
+    def close(self):
+        super().close()
+        # A page cut off inside an element still yields it, as parse_course_page does
+        if self._kind is not None:
+            self._finish()
+
+    def _finish(self):
+        kind, fragment = self._kind, "".join(self._buf)
+        self._kind, self._stack, self._buf = None, [], []
+        soup = BeautifulSoup(fragment, "html.parser")
+        if kind == "title":
+            self._title_seen = True
+            self.records.append(("title", soup.find("h1").get_text(strip=True)))
+        elif kind == "general":
+            general_activities = soup.select("ul.general-section-activities > li.activity")
+            if general_activities:
+                self.records.append(("general", parse_activities(general_activities, False)))
+        else:
+            parsed_section = parse_section(soup.select_one("li.section.main"))
+            if parsed_section:
+                self.records.append(("section",) + parsed_section)
+
+
+def iter_course_records(chunks):
+    """Yield CourseStreamParser records as soon as each element has streamed past."""
+    parser = CourseStreamParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+        if parser.records:
+            yield from parser.records
+            parser.records.clear()
+    parser.close()
+    yield from parser.records
+
+
+def parse_course_stream(chunks):
+    """Build (title, course_data) from decoded text chunks; same result as parse_course_page."""
+    return course_from_records(iter_course_records(chunks))
+
+
+def course_from_records(records):
+    """Assemble CourseStreamParser records into (title, course_data)."""
+    title = None
+    general = None
+    sections = []
+    for record in records:
+        if record[0] == "title":
+            title = record[1]
+        elif record[0] == "general":
+            general = record[1]
+        else:
+            sections.append(record[1:])
+    if title is None:
+        raise ValueError("course page has no <h1> title")
+
+    course_data = {}
+    if general:
+        course_data["General Activities"] = general
+    for section_title, parsed in sections:
+        course_data[section_title] = parsed
+    return title, course_data
+
+
+def parse_contents_modules(modules, enable_classification=True):
+    """parse_activities for the modules of one core_course_get_contents section."""
+    classifier = classifier_rules.get()
+    categorized = empty_categories(classifier)
+
+    for module in modules:
+        if module.get("uservisible") is False:
+            continue
+        description = module.get("description") or ""
+        if module.get("modname") == "label":
+            # Same rule as on the page: a label is a notice when it has h6 headings
+            if "<h6" in description:
+                notice_texts = [el.get_text(strip=True) for el in BeautifulSoup(description, "html.parser").select("h6 span")]
+                if notice_texts:
+                    categorized["notices"].append({"notice": " ".join(notice_texts)})
+        elif module.get("url"):
+            title = module.get("name", "").strip()
+            category = ActivityClassifier.FALLBACK
+            if enable_classification:
+                desc_p = BeautifulSoup(description, "html.parser").find("p") if "<p" in description else None
+                category = classifier.classify(title, desc_p.get_text(strip=True) if desc_p else "")
+            categorized[category].append({"title": title, "url": module["url"]})
+
+    return {k: v for k, v in categorized.items() if v}
+
+
+def parse_course_contents(sections):
+    """Build course_data from a core_course_get_contents response; same shape as parse_course_page.
+
+    Section 0 becomes "General Activities" (not classified), every other
+    section is keyed by its name and, as on the page, only "Week ..."
+    sections are classified.
+    """
+    course_data = {}
     for section in sections:
-        section_title_el = section.select_one(".sectionname")
-        if not section_title_el:
+        if section.get("uservisible") is False:
             continue
-        section_title = section_title_el.get_text(strip=True)
-        activity_elements = section.select("li.activity")
-        is_week_section = section_title.lower().startswith("week")
-        parsed = parse_activities(activity_elements, enable_classification=is_week_section)
+        if section.get("section") == 0:
+            parsed = parse_contents_modules(section.get("modules", ()), False)
+            if parsed:
+                course_data["General Activities"] = parsed
+            continue
+        section_title = (section.get("name") or "").strip()
+        if not section_title:
+            continue
+        parsed = parse_contents_modules(section.get("modules", ()), section_title.lower().startswith("week"))
         if parsed:
             course_data[section_title] = parsed
+    return course_data
 
-    return title, course_data
 
-start_discord_bot()
+# CPU-bound parsing, hashing and diffing run here so the event loop stays responsive
+parse_executor = ThreadPoolExecutor(max_workers=min(SCRAPE_CONCURRENCY, os.cpu_count() or 1),
+                                    thread_name_prefix="parser")
+
+
+async def offload(func, *args, **kwargs):
+    """Run func(*args, **kwargs) on parse_executor and await the result."""
+    return await asyncio.get_running_loop().run_in_executor(parse_executor, functools.partial(func, *args, **kwargs))
+
+
+# Process pool for parse_page_bytes when PARSE_WORKERS > 0, created by start_parse_pool()
+parse_pool = None
+
+
+def start_parse_pool(workers=PARSE_WORKERS):
+    """(Re)create the parsing process pool; a no-op when workers is 0."""
+    global parse_pool
+    if workers <= 0:
+        return None
+    if parse_pool is not None:
+        parse_pool.shutdown(wait=False, cancel_futures=True)
+    # spawn: workers import main fresh instead of forking a process that runs threads and an event loop
+    parse_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return parse_pool
+
+
+def stop_parse_pool():
+    global parse_pool
+    if parse_pool is not None:
+        parse_pool.shutdown(wait=False, cancel_futures=True)
+        parse_pool = None
+
+
+def parse_page_bytes(body, encoding="utf-8"):
+    """Decode, parse and hash one course page: the unit of work of the parsing stage.
+
+    Takes the raw body so only bytes are pickled on the way to a worker
+    process, and returns only the extracted (title, course_data, (hash, tree)).
+    """
+    return parse_page_bytes_timed(body, encoding)[0]
+
+
+def parse_page_bytes_timed(body, encoding="utf-8"):
+    """parse_page_bytes plus its (parse, hash) durations, which worker processes cannot record themselves."""
+    started = time.perf_counter()
+    title, data = parse_course_page(body.decode(encoding, errors="replace"))
+    parsed = time.perf_counter()
+    tree = hash_tree(data)
+    return (title, data, tree), (parsed - started, time.perf_counter() - parsed)
+
+
+def parse_contents_bytes_timed(body, encoding="utf-8"):
+    """parse_page_bytes_timed for a core_course_get_contents response; the title is None (not in the response)."""
+    started = time.perf_counter()
+    data = parse_course_contents(json.loads(body.decode(encoding, errors="replace")))
+    parsed = time.perf_counter()
+    tree = hash_tree(data)
+    return (None, data, tree), (parsed - started, time.perf_counter() - parsed)
+
+
+def run_timed(stage, func, *args):
+    """Call func(*args) and record its duration under stage; meant to run on an executor."""
+    with STAGE_SECONDS.time(stage):
+        return func(*args)
+
+
+async def parse_page(page, parser=parse_page_bytes_timed):
+    """Run parser for a FetchedPage on the process pool, or on parse_executor without one.
+
+    parser is a course source's *_bytes_timed function (parse_page_bytes_timed by default).
+    """
+    pool = parse_pool
+    try:
+        if pool is None:
+            result, (parse_seconds, hash_seconds) = await offload(parser, page.content, page.encoding)
+        else:
+            result, (parse_seconds, hash_seconds) = await asyncio.get_running_loop().run_in_executor(
+                pool, parser, page.content, page.encoding
+            )
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); replace the pool once, the course is retried next poll
+        if pool is parse_pool:
+            logging.error("Parser process pool broke; restarting it")
+            start_parse_pool()
+        raise
+    STAGE_SECONDS.observe(parse_seconds, "parse")
+    STAGE_SECONDS.observe(hash_seconds, "hash")
+    return result
+
+
+async def stream_course_page(url, validators=None):
+    """Fetch and parse a course page chunk by chunk.
+
+    Returns (status_code, parsed, new_validators); parsed is (title, course_data)
+    and is None for a 304. Each chunk is fed to the parser on parse_executor as
+    it arrives, and validators are computed on the fly so the raw body is never
+    held in memory as a whole.
+    """
+    http_client.set_cookies(read_cookies())
+    req_headers = conditional_headers(validators) if validators else {}
+    async with http_client.stream(lms_url(url), headers=req_headers) as response:
+        if response.status == 304:
+            return 304, None, None
+        check_not_login_page(str(response.url))
+        check_course_status(response.status)
+        digest = hashlib.blake2b(digest_size=16)
+        length = 0
+        decoder = codecs.getincrementaldecoder(response.charset or "utf-8")(errors="replace")
+        parser = CourseStreamParser()
+        parse_seconds = 0.0
+
+        def feed(text, final=False):
+            nonlocal parse_seconds
+            started = time.perf_counter()
+            parser.feed(text)
+            if final:
+                parser.close()
+            parse_seconds += time.perf_counter() - started
+
+        async for raw in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+            digest.update(raw)
+            length += len(raw)
+            await offload(feed, decoder.decode(raw))
+        await offload(feed, decoder.decode(b"", final=True), True)
+        STAGE_SECONDS.observe(parse_seconds, "parse")
+        parsed = course_from_records(parser.records)
+        new_validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_length": length,
+            "digest": digest.hexdigest(),
+        }
+        return response.status, parsed, new_validators
+
+
+class HtmlCourseSource:
+    """Course data scraped from the rendered course page (needs the MoodleSession cookie)."""
+    name = "html"
+    parser = staticmethod(parse_page_bytes_timed)
+
+    async def fetch(self, url, validators=None):
+        return await fetch_course_page(url, validators)
+
+    async def title(self, url, parsed_title, known_title=None):
+        return parsed_title
+
+
+class WebServiceCourseSource:
+    """Course data from the core_course_get_contents web service (needs MOODLE_WS_TOKEN).
+
+    The JSON response lists the same sections and modules as the course page
+    in a fraction of the bytes, and turning it into course_data skips parsing
+    the page. It carries no course name, so the title is looked up once with
+    core_course_get_courses_by_field and taken from the stored state after that.
+    Responses are not cacheable (no ETag), so unchanged courses are recognised
+    by the digest of the body.
+    """
+    name = "webservice"
+    parser = staticmethod(parse_contents_bytes_timed)
+
+    def __init__(self, token, endpoint=None):
+        self.token = token
+        self.endpoint = endpoint
+
+    def endpoint_for(self, url):
+        if self.endpoint:
+            return self.endpoint
+        site = lms_url(url).split("/course/view.php")[0]
+        return f"{site}/webservice/rest/server.php"
+
+    async def call(self, url, function, **params):
+        """POST a web service function to the REST endpoint of url's site; returns the FetchedPage.
+
+        The token travels in the form body, so it never shows up in logged URLs.
+        Raises RuntimeError when Moodle answers with an error object (bad token,
+        web services disabled, no access to the course, ...).
+        """
+        form = {"wstoken": self.token, "wsfunction": function, "moodlewsrestformat": "json"}
+        form.update(ws_form_params(params))
+        page = await http_client.post(self.endpoint_for(url), data=form)
+        if page.status_code != 200:
+            raise RuntimeError(f"{function} returned HTTP {page.status_code}")
+        if page.content.lstrip()[:1] == b"{":
+            reply = json.loads(page.content)
+            if "exception" in reply:
+                raise RuntimeError(f"{function} failed: {reply.get('errorcode')}: {reply.get('message')}")
+        return page
+
+    @staticmethod
+    def course_id(url):
+        course_id = course_id_from_url(url)
+        if course_id is None:
+            raise RuntimeError(f"no numeric course id in {url}")
+        return course_id
+
+    async def fetch(self, url, validators=None):
+        return await self.call(url, "core_course_get_contents", courseid=self.course_id(url))
+
+    async def title(self, url, parsed_title, known_title=None):
+        if known_title:
+            return known_title
+        page = await self.call(url, "core_course_get_courses_by_field", field="id", value=self.course_id(url))
+        courses = json.loads(page.content).get("courses") or []
+        if not courses:
+            raise RuntimeError(f"core_course_get_courses_by_field found no course for {url}")
+        return courses[0]["fullname"]
+
+
+def ws_form_params(params, prefix=""):
+    """Flatten nested lists/dicts into Moodle's REST form keys (courseids[0]=1, options[0][name]=...)."""
+    form = {}
+    for key, value in params.items():
+        name = f"{prefix}[{key}]" if prefix else str(key)
+        if isinstance(value, (list, tuple)):
+            value = dict(enumerate(value))
+        if isinstance(value, dict):
+            form.update(ws_form_params(value, name))
+        else:
+            form[name] = str(value)
+    return form
+
 
-while True:
-    for url in read_course_urls():
+# Where course data comes from: the web service when a token is configured, the course page otherwise
+course_source = WebServiceCourseSource(MOODLE_WS_TOKEN, MOODLE_WS_URL or None) if MOODLE_WS_TOKEN else HtmlCourseSource()
+
+
+class CourseChangeFeed:
+    """Finds the courses that changed since the previous check with one batched web service call.
+
+    All course ids go into a single tool_mobile_call_external_functions request
+    (CHANGE_FEED_BATCH_SIZE courses per request) that runs
+    core_course_get_updates_since for each of them, so a check costs one request
+    however many courses are tracked. A course is reported when Moodle lists
+    updated instances for it, or when its sub-call failed or is missing (its
+    full scrape then shows what is wrong). The first check looks back
+    POLL_MAX_INTERVAL, since any course not polled for longer is already due.
+    After that each check starts where the previous one was answered, by the
+    LMS's own clock (the Date header), less OVERLAP seconds for the header's
+    one-second resolution, so clock drift on either side cannot lose changes.
+
+    call is an async (url, wsfunction, **params) -> FetchedPage, normally
+    WebServiceCourseSource.call; tests can pass a stub instead.
+    """
+    OVERLAP = 2
+
+    def __init__(self, call, batch_size=CHANGE_FEED_BATCH_SIZE, lookback=POLL_MAX_INTERVAL):
+        self.call = call
+        self.batch_size = batch_size
+        self.since = time.time() - lookback
+        self._unchecked = set()  # URLs without a course id, logged once
+
+    async def changed(self, urls):
+        """Return the URLs among urls whose course changed since the last successful check."""
+        answered_at = None
+        since = int(self.since - self.OVERLAP)
+        changed = []
+        checkable = []
+        for url in urls:
+            if course_id_from_url(url) is None:
+                if url not in self._unchecked:
+                    self._unchecked.add(url)
+                    logging.warning(f"Change feed: no numeric course id in {url}; it is only polled by the sweep")
+            else:
+                checkable.append(url)
+        for i in range(0, len(checkable), self.batch_size):
+            batch = checkable[i:i + self.batch_size]
+            requests = [
+                {"function": "core_course_get_updates_since",
+                 "arguments": json.dumps({"courseid": int(course_id_from_url(url)), "since": since})}
+                for url in batch
+            ]
+            started = time.time()
+            page = await self.call(batch[0], "tool_mobile_call_external_functions", requests=requests)
+            server_time = self.server_time(page, started)
+            answered_at = server_time if answered_at is None else min(answered_at, server_time)
+            responses = json.loads(page.content).get("responses") or []
+            for index, url in enumerate(batch):
+                response = responses[index] if index < len(responses) else {"error": True}
+                if response.get("error") or json.loads(response.get("data") or "{}").get("instances"):
+                    changed.append(url)
+        if answered_at is not None:
+            self.since = answered_at
+        return changed
+
+    @staticmethod
+    def server_time(page, default):
+        """Unix time of the response's Date header (the LMS clock), or default without a usable one."""
+        try:
+            return email.utils.parsedate_to_datetime(page.headers["Date"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return default
+
+
+async def scrape_course(url):
+    """Fetch and parse one course through course_source; returns (title, course_data)."""
+    page = await course_source.fetch(url)
+    title, data, _ = await parse_page(page, course_source.parser)
+    return await course_source.title(url, title), data
+
+
+async def process_course(url):
+    """Run fetch -> parse -> diff -> notify for a single course.
+
+    Returns (url, outcome) where outcome is one of "changed", "unchanged",
+    "not_modified" (server answered 304) or "identical" (same raw bytes, parse
+    skipped). Network I/O is awaited on the loop, parsing and hashing go to
+    the parse_pool processes (or parse_executor) and diffing to parse_executor. Each course only touches its own key in
+    previous_data, so many of these can run at once.
+    """
+    course_id = course_key(url)
+    prev = previous_data.get(course_id, {})
+    # Only trust validators when we also hold the data they describe
+    validators = prev.get("validators", {}) if prev.get("hash") else {}
+    fetched_at = time.time()
+
+    if STREAMING_PARSE and course_source.name == "html":
+        # The page is parsed while it downloads, so an identical body only saves the diff
+        status_code, parsed, new_validators = await stream_course_page(url, validators)
+        if status_code == 304:
+            return url, "not_modified"
+    else:
+        page = await course_source.fetch(url, validators)
+        if page.status_code == 304:
+            return url, "not_modified"
+        new_validators = response_validators(page)
+        parsed = None
+
+    if (validators.get("content_length") == new_validators["content_length"]
+            and validators.get("digest") == new_validators["digest"]):
+        update_course_state(course_id, validators=new_validators)
+        return url, "identical"
+
+    if parsed:
+        title, data = parsed
+        data_hash, tree = await offload(run_timed, "hash", hash_tree, data)
+    else:
+        title, data, (data_hash, tree) = await parse_page(page, course_source.parser)
+
+    prev_hash = prev.get("hash")
+    if prev_hash == data_hash:
+        update_course_state(course_id, validators=new_validators)
+        return url, "unchanged"
+    title = await course_source.title(url, title, prev.get("title"))
+
+    # Descend only into the categories whose hashes moved (state from before
+    # hash trees existed has no "tree" and gets a full diff)
+    scope = changed_scope(prev["tree"], tree) if "tree" in prev else None
+    old_data = prev.get("data")
+    if old_data is None:
+        # Saved course data is not kept in memory (see save_state); read it back now that it is needed
+        old_data = {}
+        if prev.get("hash"):
+            old_data = await asyncio.to_thread(run_timed, "state_read", state_store.load_data, course_id)
+    changes = await offload(run_timed, "diff", diff_course_data, old_data, data, scope)
+    for kind, entries in changes.items():
+        if entries:
+            CHANGES_TOTAL.inc(kind, amount=len(entries))
+    if any(changes.values()):
+        logging.info(f"[+] Change detected in {title}: {describe_changes(changes)}")
+    else:
+        logging.debug(f"Hash of {title} changed without item changes (title or ordering only)")
+    to_notify = []
+    for kind, entries in changes.items():
+        for entry in entries:
+            logging.debug(f"[{kind}] {title} / {entry['section']} / {entry['category']}: {entry['item']}")
+            if kind in NOTIFY_CHANGE_KINDS:
+                to_notify.append((entry["section"], entry["item"], kind))
+    # Notifications reach the durable outbox before the new state is recorded;
+    # if this raises, the state is left alone and the change is seen again next poll
+    if to_notify and DISCORD_NOTIFY_CHANNEL_ID:
+        await notification_dispatcher.enqueue(title, to_notify, fetched_at=fetched_at)
+
+    update_course_state(course_id, changes, title=title, hash=data_hash, tree=intern_tree(tree), data=data,
+                        validators=new_validators)
+    return url, "changed"
+
+
+class CourseScheduler:
+    """Priority queue of courses keyed by their next-due time.
+
+    Every course has its own polling interval: a detected change halves it
+    (down to POLL_MIN_INTERVAL) and each quiet poll stretches it by
+    POLL_BACKOFF_FACTOR (up to POLL_MAX_INTERVAL). A failed poll leaves the
+    interval alone and is retried after POLL_ERROR_RETRY seconds, doubled for
+    each further failure in a row but never later than the interval would
+    have been. A token bucket enforces the
+    global POLL_MAX_RPS budget. Interval and next-due time are kept under each
+    course's "schedule" key in previous_data so a restart keeps the cadence.
+    """
+    def __init__(self, state, base_interval=POLL_BASE_INTERVAL, min_interval=POLL_MIN_INTERVAL,
+                 max_interval=POLL_MAX_INTERVAL, backoff_factor=POLL_BACKOFF_FACTOR, max_rps=POLL_MAX_RPS,
+                 error_retry=POLL_ERROR_RETRY):
+        self.state = state
+        self.error_retry = error_retry
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.max_rps = max_rps
+        self._heap = []  # (next_due, url)
+        self._due = {}  # url -> next_due of its live heap entry
+        self._urls = set()
+        self._tokens = max(1.0, max_rps)
+        self._tokens_at = time.monotonic()
+        self._woken = set()  # in-flight courses to run again as soon as they finish
+
+    @staticmethod
+    def course_id(url):
+        return course_key(url)
+
+    def _schedule(self, url):
+        return self.state.get(self.course_id(url), {}).get("schedule", {})
+
+    def _push(self, url, next_due):
+        self._due[url] = next_due
+        heapq.heappush(self._heap, (next_due, url))
+
+    def sync(self, urls):
+        """Track newly added course URLs (due immediately unless persisted) and drop removed ones."""
+        urls = set(urls)
+        for url in urls - self._urls:
+            if url not in self._due:
+                self._push(url, self._schedule(url).get("next_due", 0))
+        for url in self._urls - urls:
+            self._due.pop(url, None)
+            self._woken.discard(url)
+        self._urls = urls
+
+    def wake(self, url, now):
+        """Make a course due now (e.g. the change feed reported it); an in-flight course reruns when it finishes."""
+        if url not in self._urls:
+            return
+        if url not in self._due:
+            self._woken.add(url)
+        elif self._due[url] > now:
+            self._push(url, now)
+
+    def _refill(self):
+        if self.max_rps <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(max(1.0, self.max_rps), self._tokens + (now - self._tokens_at) * self.max_rps)
+        self._tokens_at = now
+
+    def pop_due(self, now):
+        """Return the due course URLs that fit in the current request budget."""
+        self._refill()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            if self.max_rps > 0 and self._tokens < 1:
+                break
+            next_due, url = heapq.heappop(self._heap)
+            # Skip heap entries left behind by removed or rescheduled courses
+            if url not in self._urls or self._due.get(url) != next_due:
+                continue
+            del self._due[url]
+            if self.max_rps > 0:
+                self._tokens -= 1
+            due.append(url)
+        return due
+
+    def seconds_until_due(self, now):
+        """Seconds until pop_due could return something, given schedule and budget."""
+        while self._heap and (self._heap[0][1] not in self._urls or self._due.get(self._heap[0][1]) != self._heap[0][0]):
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return self.max_interval
+        wait_for = max(0.0, self._heap[0][0] - now)
+        if self.max_rps > 0 and self._tokens < 1:
+            wait_for = max(wait_for, (1 - self._tokens) / self.max_rps)
+        return wait_for
+
+    def record(self, url, outcome, now):
+        """Adjust the course's interval after a poll and queue its next run."""
+        if url not in self._urls:
+            return
+        schedule = self._schedule(url)
+        interval = schedule.get("interval", self.base_interval)
+        errors = 0
+        if outcome == "error":
+            # Retry soon instead of stretching the interval: a flaky course should not be polled less
+            errors = schedule.get("errors", 0) + 1
+            delay = min(interval, self.error_retry * 2 ** (errors - 1))
+        elif outcome == "changed":
+            interval = max(self.min_interval, interval / 2)
+            delay = interval
+        else:
+            interval = min(self.max_interval, interval * self.backoff_factor)
+            delay = interval
+        # A little jitter keeps courses that were added together from staying in lockstep
+        next_due = now + delay * random.uniform(0.9, 1.1)
+        if url in self._woken:
+            self._woken.discard(url)
+            next_due = now
+        schedule = {"interval": interval, "next_due": next_due}
+        if errors:
+            schedule["errors"] = errors
+        update_course_state(self.course_id(url), state=self.state, schedule=schedule)
+        self._push(url, next_due)
+
+
+# Course ids whose state changed since the last save, and change-history rows not yet written
+_dirty_courses = set()
+_pending_history = []
+
+
+def update_course_state(course_id, changes=None, state=None, **fields):
+    """Update fields of a course's state entry and mark it for the next save_state().
+
+    changes, a change set from diff_course_data, is queued for the history table.
+    """
+    state = previous_data if state is None else state
+    with state_lock:
+        state.setdefault(course_id, {}).update(fields)
+        if state is previous_data:
+            _dirty_courses.add(course_id)
+        if changes:
+            detected_at = datetime.now(timezone.utc).isoformat()
+            for kind, entries in changes.items():
+                for entry in entries:
+                    _pending_history.append((course_id, detected_at, kind, entry))
+
+
+def compact_course_state(state):
+    """Course state as loaded from a store, with interned keys and the hash tree as records.
+
+    json.loads creates fresh key strings for every course; interning them (and
+    the section/category names in the tree) shares one copy across courses.
+    """
+    compact = {sys.intern(key): value for key, value in state.items()}
+    for key in ("validators", "schedule"):
+        if isinstance(compact.get(key), dict):
+            compact[key] = {sys.intern(k): v for k, v in compact[key].items()}
+    if isinstance(compact.get("tree"), dict):
+        compact["tree"] = tree_from_json(compact["tree"])
+    return compact
+
+
+class JsonStateStore:
+    """The original whole-file scraper_state.json store, written atomically."""
+    # The whole file is rewritten from memory, so course data has to stay loaded
+    lazy_data = False
+
+    def __init__(self, path=STATE_JSON_PATH):
+        self.path = path
+
+    def load(self, owns=None):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return {}
+        return {k: compact_course_state(v) for k, v in state.items() if owns is None or owns(k)}
+
+    def load_data(self, course_id):
+        return self.load(lambda k: k == course_id).get(course_id, {}).get("data", {})
+
+    def serialize(self, state, dirty):
+        # The whole file is rewritten, so every course is serialized
+        return json.dumps(state, indent=2, ensure_ascii=False, default=_state_json)
+
+    def write(self, payload, history):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        pass
+
+
+class SqliteStateStore:
+    """SQLite state store: one row per course plus a change-history table.
+
+    Only courses that changed since the last save are written, all in one
+    transaction, so a crash leaves either the old or the new state. The
+    database runs in WAL mode so readers never block the writer. On first use
+    an existing scraper_state.json is imported and renamed to
+    scraper_state.json.migrated.
+
+    Course data (every item of a course) lives in its own column: load()
+    leaves it out, and it is read one course at a time with load_data() when
+    a course changed and has to be diffed.
+    """
+    lazy_data = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS courses (
+            course_id TEXT PRIMARY KEY,
+            title TEXT,
+            hash TEXT,
+            state TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            data TEXT
+        );
+        CREATE TABLE IF NOT EXISTS change_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_id TEXT NOT NULL,
+            detected_at TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            section TEXT,
+            category TEXT,
+            item TEXT NOT NULL,
+            detail TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_change_history_course ON change_history (course_id, detected_at);
+    """
+
+    def __init__(self, path=STATE_DB_PATH, json_path=STATE_JSON_PATH):
+        self.path = path
+        self.json_path = json_path
+        # Writes happen in an asyncio.to_thread() worker, one save at a time
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        if "data" not in {row[1] for row in self.conn.execute("PRAGMA table_info(courses)")}:
+            try:
+                self.conn.execute("ALTER TABLE courses ADD COLUMN data TEXT")
+            except sqlite3.OperationalError:
+                pass  # another worker added it first
+        # load_data() runs on executor threads while save_state() may be writing
+        self._lock = threading.Lock()
+
+    def load(self, owns=None):
+        """Return {course_id: state} without course data, only for the course ids accepted by owns if given."""
+        self._migrate_json()
+        with self._lock:
+            rows = self.conn.execute("SELECT course_id, state FROM courses").fetchall()
+        loaded = {}
+        moved = []
+        for course_id, state in rows:
+            if owns is not None and not owns(course_id):
+                continue
+            state = json.loads(state)
+            if "data" in state:
+                # Written before course data had its own column: move it there once
+                data = state.pop("data")
+                moved.append((json.dumps(state, ensure_ascii=False), json.dumps(data, ensure_ascii=False), course_id))
+            loaded[course_id] = compact_course_state(state)
+        if moved:
+            with self._lock, self.conn:
+                self.conn.executemany("UPDATE courses SET state = ?, data = ? WHERE course_id = ?", moved)
+            logging.info(f"Moved the course data of {len(moved)} courses to its own column in {self.path}")
+        return loaded
+
+    def load_data(self, course_id):
+        """Return the stored course_data of one course ({} if there is none)."""
+        with self._lock:
+            row = self.conn.execute("SELECT data FROM courses WHERE course_id = ?", (course_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def _migrate_json(self):
+        if not os.path.exists(self.json_path):
+            return
+        # Sharded workers started together all get here: BEGIN IMMEDIATE lets one
+        # of them check, import and rename while the others wait for the lock
+        with self._lock, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            if not os.path.exists(self.json_path):
+                return
+            if self.conn.execute("SELECT 1 FROM courses LIMIT 1").fetchone():
+                logging.warning(f"Both {self.path} and {self.json_path} exist; ignoring {self.json_path}")
+                return
+            state = JsonStateStore(self.json_path).load()
+            self._write_rows(self.serialize(state, state.keys()), [])
+            try:
+                os.replace(self.json_path, self.json_path + ".migrated")
+            except FileNotFoundError:
+                pass  # renamed by another process in the meantime: already migrated
+        logging.info(f"Migrated {len(state)} courses from {self.json_path} to {self.path}")
+
+    def serialize(self, state, dirty):
+        # data is None when the course data was not touched since the last save (see save_state)
+        now = datetime.now(timezone.utc).isoformat()
+        rows = []
+        for course_id in dirty:
+            if course_id not in state:
+                continue
+            entry = state[course_id]
+            data = entry.get("data")
+            rows.append((
+                course_id, entry.get("title"), entry.get("hash"),
+                json.dumps({k: v for k, v in entry.items() if k != "data"}, ensure_ascii=False, default=_state_json),
+                json.dumps(data, ensure_ascii=False) if data is not None else None, now,
+            ))
+        return rows
+
+    def write(self, payload, history):
+        with self._lock, self.conn:
+            self._write_rows(payload, history)
+
+    def _write_rows(self, payload, history):
+        history_rows = []
+        for course_id, detected_at, kind, entry in history:
+            detail = {k: v for k, v in entry.items() if k.startswith("old_")}
+            history_rows.append((
+                course_id, detected_at, kind, entry["section"], entry["category"],
+                json.dumps(entry["item"], ensure_ascii=False),
+                json.dumps(detail, ensure_ascii=False) if detail else None,
+            ))
+        self.conn.executemany(
+            "INSERT INTO courses (course_id, title, hash, state, data, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(course_id) DO UPDATE SET title=excluded.title, hash=excluded.hash, "
+            "state=excluded.state, data=COALESCE(excluded.data, courses.data), updated_at=excluded.updated_at",
+            payload,
+        )
+        self.conn.executemany(
+            "INSERT INTO change_history (course_id, detected_at, kind, section, category, item, detail) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            history_rows,
+        )
+
+    def close(self):
+        self.conn.close()
+
+
+STATE_STORES = {"json": JsonStateStore, "sqlite": SqliteStateStore}
+state_store = None
+
+
+def open_state_store(backend=STATE_BACKEND, owns=None):
+    """Open the configured state store and load its contents into previous_data.
+
+    owns, a course id predicate, limits loading to this worker's shard.
+    """
+    global state_store
+    if backend not in STATE_STORES:
+        logging.warning(f"Unknown STATE_BACKEND {backend!r}; using sqlite")
+        backend = "sqlite"
+    state_store = STATE_STORES[backend]()
+    loaded = state_store.load(owns)
+    with state_lock:
+        previous_data.clear()
+        previous_data.update(loaded)
+    logging.info(f"Loaded state for {len(loaded)} courses from {backend} store")
+    return state_store
+
+
+def save_state():
+    """Persist courses changed since the last call (and their change history).
+
+    With a store that keeps course data on disk (SQLite), the data of the
+    courses just written is then dropped from memory; process_course reads it
+    back with load_data() the next time the course changes.
+    """
+    with state_lock:
+        if not _dirty_courses and not _pending_history:
+            return
+        written = set(_dirty_courses)
+        # update_course_state() takes this lock on the event loop, so only copy the
+        # entries here (it replaces field values, never mutates them) and serialize outside
+        courses = previous_data.keys() if isinstance(state_store, JsonStateStore) else written & previous_data.keys()
+        snapshot = {course_id: dict(previous_data[course_id]) for course_id in courses}
+        history = list(_pending_history)
+        _dirty_courses.clear()
+        _pending_history.clear()
+    try:
+        with STAGE_SECONDS.time("state_write"):
+            state_store.write(state_store.serialize(snapshot, written), history)
+    except Exception:
+        # Keep the work queued so the next save retries it
+        with state_lock:
+            _dirty_courses.update(snapshot.keys())
+            _pending_history[:0] = history
+        raise
+    if state_store.lazy_data:
+        with state_lock:
+            # Courses dirtied again during the write may hold data that is not on disk yet
+            for course_id in written - _dirty_courses:
+                previous_data.get(course_id, {}).pop("data", None)
+
+
+class HashRing:
+    """Consistent-hash ring that maps course ids to worker ids.
+
+    Each worker is placed at SHARD_VNODES pseudo-random points; a course
+    belongs to the first point clockwise from its own hash. Adding or removing
+    a worker only moves the courses on that worker's arcs. Points come from
+    blake2b, so every process builds the same ring from the same members.
+    """
+    def __init__(self, workers, vnodes=SHARD_VNODES):
+        points = sorted((self._point(f"{worker}#{i}"), worker) for worker in workers for i in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._owners = [worker for _, worker in points]
+
+    @staticmethod
+    def _point(key):
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def owner(self, course_id):
+        if not self._points:
+            return None
+        return self._owners[bisect.bisect(self._points, self._point(course_id)) % len(self._points)]
+
+
+class ShardCoordinator:
+    """Membership of sharded scraper workers, kept in a SQLite table ("shard_workers").
+
+    Every worker upserts its heartbeat each SHARD_HEARTBEAT_INTERVAL and counts
+    the workers seen within SHARD_LEASE_TIMEOUT as alive; all of them build
+    the same HashRing from that list, so a dead worker's courses move to the
+    survivors without any messages being exchanged. Until every worker has
+    seen a membership change (one heartbeat interval) a course may briefly
+    be polled by two workers or none. A worker that could not write its own
+    heartbeat for a whole lease owns nothing until it can, because the others
+    have taken its courses over by then.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS shard_workers (
+            worker_id TEXT PRIMARY KEY,
+            host TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            started_at REAL NOT NULL,
+            heartbeat REAL NOT NULL
+        );
+    """
+
+    def __init__(self, worker_id, path=SHARD_COORDINATOR_PATH, lease_timeout=SHARD_LEASE_TIMEOUT, vnodes=SHARD_VNODES):
+        self.worker_id = worker_id
+        self.lease_timeout = lease_timeout
+        self.vnodes = vnodes
+        self.host = socket.gethostname()
+        self.pid = os.getpid()
+        self.members = ()
+        self.ring = HashRing((), vnodes)
+        self._last_beat = 0.0
+        # Used from asyncio.to_thread() workers, one call at a time
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def join(self):
+        """Register this worker; raises if a live process elsewhere already uses the same id."""
+        row = self.conn.execute(
+            "SELECT host, pid, heartbeat FROM shard_workers WHERE worker_id = ?", (self.worker_id,)
+        ).fetchone()
+        if row and (row[0], row[1]) != (self.host, self.pid) and row[2] >= time.time() - self.lease_timeout:
+            raise RuntimeError(f"Shard worker id {self.worker_id!r} is already in use by {row[0]} pid {row[1]}")
+        return self.heartbeat()
+
+    def heartbeat(self):
+        """Renew this worker's lease and refresh the ring; returns the live worker ids."""
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO shard_workers (worker_id, host, pid, started_at, heartbeat) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET host=excluded.host, pid=excluded.pid, heartbeat=excluded.heartbeat",
+                (self.worker_id, self.host, self.pid, now, now),
+            )
+            # Forget workers that have been gone for a long time
+            self.conn.execute("DELETE FROM shard_workers WHERE heartbeat < ?", (now - 100 * self.lease_timeout,))
+            members = tuple(row[0] for row in self.conn.execute(
+                "SELECT worker_id FROM shard_workers WHERE heartbeat >= ? ORDER BY worker_id", (now - self.lease_timeout,)
+            ))
+        self._last_beat = now
+        if members != self.members:
+            logging.info(f"Shard workers: {', '.join(members)} ({len(members)} live, this is {self.worker_id})")
+            self.members = members
+            self.ring = HashRing(members, self.vnodes)
+        return members
+
+    def leave(self):
+        """Drop this worker's row so the others take its courses over right away."""
+        with self.conn:
+            self.conn.execute("DELETE FROM shard_workers WHERE worker_id = ? AND pid = ?", (self.worker_id, self.pid))
+        self.conn.close()
+
+    def owns(self, course_id):
+        if time.time() - self._last_beat > self.lease_timeout:
+            return False
+        return self.ring.owner(course_id) == self.worker_id
+
+
+# Set by run() when SHARD_WORKER_ID is configured
+shard_coordinator = None
+
+
+async def run_shard_heartbeat():
+    while True:
+        await asyncio.sleep(SHARD_HEARTBEAT_INTERVAL)
         try:
-            course_id = url.split("id=")[-1]
-            title, data = scrape_course(url)
-            data_hash = hash_data(data)
+            await asyncio.to_thread(shard_coordinator.heartbeat)
+        except Exception:
+            logging.exception("Failed to renew shard heartbeat")
+
+
+async def rebalance_shard(urls, owned, pending):
+    """Keep only this worker's courses from urls and hand over those whose owner changed.
+
+    owned is the set of course ids owned after the previous call (None on the
+    first call, when previous_data holds what open_state_store() loaded).
+    Polls of courses that moved away are cancelled and their state is saved
+    before it is dropped from memory, so the new owner can load it; state of
+    courses that moved here is loaded from the shared state store. Returns
+    (owned urls, owned course ids).
+    """
+    by_id = {CourseScheduler.course_id(url): url for url in urls}
+    now_owned = {course_id for course_id in by_id if shard_coordinator.owns(course_id)}
+    held = (set(previous_data) & by_id.keys()) if owned is None else owned
+    lost = held - now_owned
+    gained = now_owned - held
+    if lost:
+        for task, url in pending.items():
+            if CourseScheduler.course_id(url) in lost:
+                task.cancel()
+        await asyncio.to_thread(save_state)
+        with state_lock:
+            for course_id in lost:
+                previous_data.pop(course_id, None)
+    if gained:
+        loaded = await asyncio.to_thread(state_store.load, gained.__contains__)
+        with state_lock:
+            for course_id, state in loaded.items():
+                previous_data.setdefault(course_id, state)
+    if owned is not None and (lost or gained):
+        logging.info(f"Shard rebalanced: handed over {len(lost)} courses, took over {len(gained)}, "
+                     f"now polling {len(now_owned)} of {len(by_id)}")
+    return [by_id[course_id] for course_id in now_owned], now_owned
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve the metrics registry at http://host:port/metrics; returns the runner for cleanup."""
+    async def handle_metrics(request):
+        body = await asyncio.to_thread(metrics.render)
+        return web.Response(body=body.encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
+
+
+async def scrape_with_slot(slots, url):
+    async with slots:
+        return await process_course(url)
+
+
+def log_summary(outcomes, in_flight, elapsed):
+    logging.info(
+        f"Scraped {sum(outcomes.values())} courses in the last {elapsed:.0f}s "
+        f"({outcomes.get('changed', 0)} changed, {outcomes.get('not_modified', 0)} not modified, "
+        f"{outcomes.get('identical', 0)} identical, {outcomes.get('error', 0)} errors), "
+        f"{in_flight} in flight"
+    )
+    http_stats = http_client.pop_stats()
+    reused = http_stats["requests"] - http_stats["new_connections"]
+    logging.info(
+        f"HTTP: {http_stats['requests']} requests, {http_stats['new_connections']} new connections "
+        f"({max(reused, 0)} reused), {http_stats['retries']} retries, {http_stats['timeouts']} timeouts, "
+        f"{http_stats['failures']} failures"
+    )
+    notify_stats = notification_dispatcher.pop_stats()
+    if notify_stats["batches"] or notify_stats["queue_depth"] or notify_stats["dead"]:
+        logging.info(
+            f"Notifications: {notify_stats['items']} items in {notify_stats['messages']} messages "
+            f"({notify_stats['items'] / elapsed:.2f} items/s, {notify_stats['batches']} batches, "
+            f"avg fetch-to-notify latency {notify_stats['latency_total'] / max(notify_stats['groups'], 1):.1f}s, "
+            f"max {notify_stats['latency_max']:.1f}s), {notify_stats['rate_limited']} rate limited, "
+            f"{notify_stats['failed']} failed, {notify_stats['queue_depth']} pending in outbox, "
+            f"{notify_stats['dead']} dead"
+        )
+    if DISCORD_LOG_HANDLER is not None and DISCORD_LOG_HANDLER.dropped_total:
+        logging.info(f"Discord log forwarding has dropped {DISCORD_LOG_HANDLER.dropped_total} records so far (buffer full)")
+
+
+def start_change_feed():
+    """Return a CourseChangeFeed when CHANGE_FEED_INTERVAL is set and the web service is in use, else None."""
+    if CHANGE_FEED_INTERVAL <= 0:
+        return None
+    if course_source.name != "webservice":
+        logging.warning("CHANGE_FEED_INTERVAL needs MOODLE_WS_TOKEN; polling every course on its schedule instead")
+        return None
+    return CourseChangeFeed(course_source.call)
+
+
+async def run_scraper():
+    """Poll courses as they come due, each course as its own task on the loop.
+
+    With a change feed, courses are polled every POLL_MAX_INTERVAL as a safety
+    sweep and the feed makes the ones it reports due right away.
+    """
+    feed = start_change_feed()
+    if feed is None:
+        scheduler = CourseScheduler(previous_data)
+    else:
+        scheduler = CourseScheduler(previous_data, base_interval=POLL_MAX_INTERVAL, min_interval=POLL_MAX_INTERVAL)
+    slots = asyncio.Semaphore(SCRAPE_CONCURRENCY)
+    logging.info(
+        f"Scraper started with concurrency={SCRAPE_CONCURRENCY} per_host={SCRAPE_PER_HOST_LIMIT} "
+        f"interval={scheduler.min_interval:g}-{POLL_MAX_INTERVAL:g}s max_rps={POLL_MAX_RPS:g} "
+        f"parse_workers={PARSE_WORKERS or 'threads'} source={course_source.name}"
+        + (f" change_feed={CHANGE_FEED_INTERVAL:g}s" if feed is not None else "")
+    )
+    feed_task = None
+    next_feed = time.monotonic()
+    pending = {}
+    outcomes = {}
+    owned = None
+    last_save = last_summary = time.monotonic()
+    try:
+        while True:
+            urls = read_course_urls()
+            if shard_coordinator is not None:
+                urls, owned = await rebalance_shard(urls, owned, pending)
+            scheduler.sync(urls)
+            if feed is not None and feed_task is None and time.monotonic() >= next_feed:
+                feed_task = asyncio.create_task(feed.changed(sorted(urls)), name="change-feed")
+            for url in scheduler.pop_due(time.time()):
+                pending[asyncio.create_task(scrape_with_slot(slots, url))] = url
+
+            # Wake up for whichever comes first: a finished course or feed check, the next
+            # due course or feed check, or a periodic re-read of course_urls.json
+            timeout = min(scheduler.seconds_until_due(time.time()), 5)
+            if feed is not None and feed_task is None:
+                timeout = min(timeout, max(0.0, next_feed - time.monotonic()))
+            waiting = set(pending) | ({feed_task} if feed_task is not None else set())
+            if waiting:
+                done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(timeout)
+                done = ()
 
-            prev_hash = previous_data.get(course_id, {}).get("hash")
-            if prev_hash != data_hash:
-                logging.info(f"[+] Change detected in {title}")
-                # Compare and send changes
-                old_data = previous_data.get(course_id, {}).get("data", {})
-                for section, entries in data.items():
-                    for key in entries:
-                        new_items = [i for i in entries[key] if i not in old_data.get(section, {}).get(key, [])]
-                        for item in new_items:
-                            send_discord_notification(title, section, item)
+            if feed_task is not None and feed_task in done:
+                done.discard(feed_task)
+                try:
+                    reported = feed_task.result()
+                except Exception as e:
+                    logging.error(f"[!] Change feed check failed: {e}")
+                else:
+                    logging.log(logging.INFO if reported else logging.DEBUG,
+                                f"Change feed: {len(reported)} of {len(urls)} courses changed")
+                    now = time.time()
+                    for url in reported:
+                        scheduler.wake(url, now)
+                feed_task = None
+                next_feed = time.monotonic() + CHANGE_FEED_INTERVAL
+
+            changed = False
+            for task in done:
+                url = pending.pop(task)
+                if task.cancelled():
+                    continue  # handed over to another shard worker
+                try:
+                    _, outcome = task.result()
+                except Exception as e:
+                    logging.error(f"[!] Error fetching {url}: {e}")
+                    outcome = "error"
+                scheduler.record(url, outcome, time.time())
+                COURSES_TOTAL.inc(outcome)
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                changed = changed or outcome == "changed"
+
+            COURSES_IN_FLIGHT.set(len(pending))
+
+            now = time.monotonic()
+            if done and (changed or now - last_save >= 60):
+                try:
+                    await asyncio.to_thread(save_state)
+                except Exception:
+                    logging.exception("Failed to save scraper state")
+                last_save = now
+
+            if now - last_summary >= 300:
+                log_summary(outcomes, len(pending), now - last_summary)
+                outcomes = {}
+                last_summary = now
+    finally:
+        # Cancelled on shutdown: abandon in-flight courses, they are polled again next run
+        tasks = list(pending) + ([feed_task] if feed_task is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run():
+    """Run the scraper, the notification dispatcher and the Discord bot on one event loop.
+
+    Returns after SIGINT/SIGTERM (or if the scraper itself fails), once every
+    task has been cancelled, the bot and HTTP session are closed and the
+    state has been saved.
+    """
+    global shard_coordinator
+    if SHARD_WORKER_ID:
+        if STATE_BACKEND != "sqlite":
+            logging.error("SHARD_WORKER_ID needs STATE_BACKEND=sqlite (the state database is shared by all workers)")
+            return
+        shard_coordinator = ShardCoordinator(SHARD_WORKER_ID)
+        await asyncio.to_thread(shard_coordinator.join)
+        open_state_store(owns=shard_coordinator.owns)
+    else:
+        open_state_store()
+    start_parse_pool()
+    await http_client.start()
+    metrics_runner = None
+    if METRICS_PORT:
+        try:
+            metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            logging.error(f"Could not serve metrics on {METRICS_HOST}:{METRICS_PORT}: {e}")
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # e.g. Windows: Ctrl+C still arrives as KeyboardInterrupt
+
+    scraper = asyncio.create_task(run_scraper(), name="scraper")
+    tasks = [scraper]
+    if shard_coordinator is not None:
+        tasks.append(asyncio.create_task(run_shard_heartbeat(), name="shard-heartbeat"))
+    if DISCORD_BOT_TOKEN:
+        tasks.append(asyncio.create_task(run_discord_bot(), name="discord-bot"))
+    else:
+        logging.info("DISCORD_BOT_TOKEN not set; Discord admin bot will not start.")
+    notification_dispatcher.start()
+    stopper = asyncio.create_task(stop.wait())
+    try:
+        await asyncio.wait([scraper, stopper], return_when=asyncio.FIRST_COMPLETED)
+        if scraper.done():
+            scraper.result()
+    finally:
+        logging.info("Shutting down")
+        stopper.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await notification_dispatcher.stop()
+        if not bot.is_closed():
+            await bot.close()
+        await http_client.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        try:
+            await asyncio.to_thread(save_state)
+        except Exception:
+            logging.exception("Failed to save scraper state")
+        if shard_coordinator is not None:
+            try:
+                await asyncio.to_thread(shard_coordinator.leave)
+            except Exception:
+                logging.exception("Failed to leave the shard ring")
+        parse_executor.shutdown(wait=False, cancel_futures=True)
+        stop_parse_pool()
 
-                previous_data[course_id] = {
-                    "title": title,
-                    "hash": data_hash,
-                    "data": data
-                }
 
-        except Exception as e:
-            logging.error(f"[!] Error fetching {url}: {e}")
+def main():
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
 
-    with open("scraper_state.json", "w", encoding="utf-8") as f:
-        json.dump(previous_data, f, indent=2, ensure_ascii=False)
 
-    time.sleep(120)
\ No newline at end of file
+if __name__ == "__main__":
+    main()